@@ -1,70 +1,215 @@
+import time
+from typing import Optional
 from fastapi import Request, Depends
-from celery import Celery, signature, chord, states
+from celery import Celery, signature, chord, group, states
 from celery.result import AsyncResult
+from celery.utils import uuid
 
+from api.bv import encoding, streaming
 from api.bv.models import Journey
 from api.bv.settings import Settings
 
 from loguru import logger
 
+# Request id of the last search per fingerprint
+INFLIGHT_KEY = "bonvoyage:inflight:{}"
+# Deletes the in-flight key only if it still holds the given request id
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 
 class Client(Celery):
     workers = []
 
-    def __init__(self, config_prefix="CELERY"):
+    def __init__(self, settings: Settings = None, config_prefix="CELERY"):
         self.config_prefix = config_prefix
         super(Client, self).__init__("bonvoyage")
 
-        self.init_app(settings=Settings())
+        self.init_app(settings=settings if settings is not None else Settings())
 
     def init_app(self, settings: Settings):
         self.config_from_object(settings)
 
         # List of workers
         self.workers = settings.workers.split(',')
+        self.streaming = settings.streaming_results
 
-    def publish_journey(self, journey: Journey) -> AsyncResult:
-        logger.info(f"Emitting: {journey} to {self.workers} workers")
+        # Workers time budget, then soft and hard time limits
+        self.worker_deadline = settings.worker_deadline
+        self.worker_time_limit_margin = settings.worker_time_limit_margin
 
-        # Preparing worker's signatures
-        kwargs = journey.as_celery_kwargs()
-        workers_sigs = [
-            signature(
+        # Faster encoding of tasks and decoding of results
+        if settings.json_encoder == encoding.ORJSON and encoding.orjson is not None:
+            encoding.register_kombu_serializer()
+            self.conf.task_serializer = encoding.ORJSON
+
+        self.coalescing_window = settings.coalescing_window
+        self.search_cache = settings.search_cache
+        self.partial_results_ttl = settings.partial_results_ttl
+
+    def workers_signatures(self, kwargs: dict, link=None, workers: list = None, link_error=None) -> list:
+        """One signature per worker, each with its time budget and limits"""
+        worker_kwargs = dict(kwargs, deadline=time.time() + self.worker_deadline)
+        soft_time_limit = self.worker_deadline + self.worker_time_limit_margin
+        workers_sigs = list()
+        for k in workers if workers is not None else self.workers:
+            sig = signature(
                 "worker",
-                kwargs=kwargs,
+                kwargs=worker_kwargs,
                 routing_key=f"journey.{k}",
                 exchange="bonvoyage",
+                soft_time_limit=soft_time_limit,
+                time_limit=soft_time_limit + self.worker_time_limit_margin,
             )
-            for k in self.workers
-        ]
+            if link is not None:
+                sig.link(link.clone())
+            if link_error is not None:
+                sig.link_error(link_error.clone(kwargs={"worker": k}))
+            workers_sigs.append(sig)
+        return workers_sigs
+
+    def coalesce(self, journey: Journey, fingerprint: str, request_id: str) -> Optional[AsyncResult]:
+        """
+        Returns the request of an identical search submitted within the window,
+        otherwise registers request_id as the one for this search.
+        """
+        key = INFLIGHT_KEY.format(fingerprint)
+        client = self.backend.client
+        if client.set(key, request_id, nx=True, ex=self.coalescing_window):
+            return None
+
+        existing = client.get(key)
+        if existing is None:
+            # Expired in between
+            return None
+        r = self.AsyncResult(id=existing.decode())
+        if r.failed():
+            # Failures are not worth sharing, this request replaces it
+            client.set(key, request_id, ex=self.coalescing_window)
+            return None
+        logger.info(f"Coalescing: {journey} with {r.id}")
+        return r
+
+    def release(self, fingerprint: str, request_id: str):
+        """Unregisters request_id as the request of this search, if it still is"""
+        self.backend.client.eval(RELEASE_SCRIPT, 1, INFLIGHT_KEY.format(fingerprint), request_id)
+
+    def publish_journey(self, journey: Journey) -> AsyncResult:
+        request_id = uuid()
+        fingerprint = journey.fingerprint()
+        if self.coalescing_window > 0:
+            r = self.coalesce(journey, fingerprint, request_id)
+            if r is not None:
+                return r
+
+        try:
+            return self.publish_journey_search(journey, fingerprint, request_id)
+        except Exception:
+            if self.coalescing_window > 0:
+                # Never submitted, identical searches must not be coalesced with it
+                self.release(fingerprint, request_id)
+            raise
+
+    def publish_journey_search(self, journey: Journey, fingerprint: str, request_id: str) -> AsyncResult:
+        if self.search_cache:
+            cached = streaming.get_cached_searches(self.backend.client, fingerprint, self.workers)
+            if cached:
+                return self.publish_journey_refresh(journey, fingerprint, request_id, cached)
+
+        if self.streaming:
+            return self.publish_journey_stream(journey, fingerprint, request_id)
+
+        logger.info(f"Emitting: {journey} to {self.workers} workers")
+
+        # Preparing worker's signatures
+        kwargs = journey.as_celery_kwargs()
+        workers_sigs = self.workers_signatures(kwargs)
         # Broker sig, then celery chord for orchestration
+        broker_kwargs = dict(kwargs, fingerprint=fingerprint) if self.search_cache else kwargs
         broker_signature = signature(
-            "broker", kwargs=kwargs, routing_key="journey.broker", exchange="bonvoyage"
+            "broker", kwargs=broker_kwargs, routing_key="journey.broker", exchange="bonvoyage"
         )
-        r = chord(workers_sigs)(broker_signature)
+        r = chord(workers_sigs)(broker_signature, task_id=request_id)
         logger.info(f"Chord emitted {r.id}")
         return r
 
-    def get_result(self, uuid: str):
+    def publish_journey_stream(self, journey: Journey, fingerprint: str = None, request_id: str = None,
+                               workers: list = None) -> AsyncResult:
+        """Each worker result is sent to the broker as soon as it is available"""
+        workers = workers if workers is not None else self.workers
+        logger.info(f"Streaming: {journey} to {workers} workers")
+
+        request_id = request_id or uuid()
+        kwargs = journey.as_celery_kwargs()
+        partial_kwargs = dict(kwargs, request_id=request_id, workers=self.workers)
+        if self.search_cache and fingerprint is not None:
+            partial_kwargs["fingerprint"] = fingerprint
+        partial_signature = signature(
+            "broker.partial",
+            kwargs=partial_kwargs,
+            routing_key="journey.broker",
+            exchange="bonvoyage",
+        )
+        # Workers failing without a payload (e.g. hard time limit) still count as done
+        failed_signature = signature(
+            "broker.failed",
+            kwargs={"request_id": request_id, "workers": self.workers},
+            routing_key="journey.broker",
+            exchange="bonvoyage",
+        )
+        workers_sigs = self.workers_signatures(
+            kwargs, link=partial_signature, workers=workers, link_error=failed_signature
+        )
+        # The group id is the request id
+        r = group(workers_sigs).apply_async(task_id=request_id)
+        logger.info(f"Group emitted {r.id}")
+        return r
+
+    def publish_journey_refresh(self, journey: Journey, fingerprint: str, request_id: str,
+                                cached: dict) -> AsyncResult:
+        """
+        Serves the cached journeys as streaming results, and only runs the
+        workers whose journeys are not cached (anymore).
+        """
+        streaming.seed_partial_results(
+            self.backend.client, request_id, cached, len(self.workers), self.partial_results_ttl
+        )
+        stale = [worker for worker in self.workers if worker not in cached]
+        if not stale:
+            logger.info(f"Cached: {journey} served as {request_id}")
+            return self.AsyncResult(id=request_id)
+
+        logger.info(f"Cached: {journey} partially served as {request_id}")
+        return self.publish_journey_stream(journey, fingerprint, request_id, workers=stale)
+
+    async def get_result_async(self, redis, uuid: str):
+        """Current results of a request with their status code, read with an async client"""
         logger.info("Fetching results for {}", uuid)
-        res = ({"error": "Unknown"}, 500)
-        try:
-            task_result = AsyncResult(id=uuid)
-            if task_result.successful():
-                # Everything is OK, return the result
-                res = (task_result.result, 200)
-                logger.info(f"Task {uuid} completed successfully! Seeding results to Front.")
-            elif task_result.status == states.FAILURE:
-                res = ({"error": task_result.result}, 500)
-            else:
-                # Task still running,please come back later
-                logger.info("Task {} still running".format(uuid))
-                res = ({}, 204)
-        except TimeoutError:
-            # Task (with all workers) took too much time.
-            res = (
-                {"error": "Journey took too much time to calculate, it was timeouted"},
-                410,
-            )
-        finally:
-            return res
+        partial_results = await streaming.get_partial_results_async(redis, uuid)
+        if partial_results is not None and (self.streaming or partial_results["complete"]):
+            # Streaming mode, current merged results with their completion
+            return partial_results, 200
+        elif partial_results is not None:
+            # Partially cached search, clients not streaming only get complete results
+            logger.info("Task {} still running".format(uuid))
+            return {}, 204
+
+        meta = await streaming.get_task_meta_async(redis, uuid, decode=self.backend.decode)
+        if meta is not None and meta["status"] == states.SUCCESS:
+            logger.info(f"Task {uuid} completed successfully! Seeding results to Front.")
+            return meta["result"], 200
+        elif meta is not None and meta["status"] == states.FAILURE:
+            return {"error": meta["result"]}, 500
+
+        # Task still running,please come back later
+        logger.info("Task {} still running".format(uuid))
+        return {}, 204
+
+
+def get_client(request: Request) -> Client:
+    """Dependency on the client built once at startup, see create_app()"""
+    return request.app.celery
@@ -0,0 +1,99 @@
+"""
+JSON encoding of the API responses, push channels and celery messages.
+
+orjson is used when it is installed and selected (JSON_ENCODER), the standard
+json module otherwise. Both produce standard JSON, so clients, workers and
+broker do not need to use the same encoder.
+"""
+import gzip
+import json
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse, Response
+from kombu.serialization import register
+from loguru import logger
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional dependency
+    brotli = None
+
+ORJSON = "orjson"
+JSON = "json"
+
+
+def _default(obj):
+    # Types handled by kombu JSON encoder but not by orjson
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # NaN and Infinity, as written by the json module, are not standard JSON
+        return json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def register_kombu_serializer():
+    """
+    "orjson" celery serializer. Its content type is the JSON one, so it also
+    decodes all the JSON messages received by the process. Workers register the
+    same one (worker/wire.py), keep both in sync.
+    """
+    register(ORJSON, orjson_dumps, orjson_loads, content_type="application/json", content_encoding="utf-8")
+
+
+class Encoder:
+    def __init__(self, name: str = ORJSON):
+        if name == ORJSON and orjson is None:
+            logger.warning("orjson is not installed, falling back on json")
+            name = JSON
+        self.name = name
+        self.dumps = orjson_dumps if name == ORJSON else json_dumps
+        self.loads = orjson_loads if name == ORJSON else json.loads
+
+        encoder = self
+
+        class Response(JSONResponse):
+            def render(self, content) -> bytes:
+                return encoder.dumps(content)
+
+        # Routes returning plain data are encoded with it, others can return
+        # it directly to skip FastAPI jsonable_encoder pass on large payloads
+        self.response_class = Response
+
+
+def compress(response: Response, accept_encoding: str, minimum_size: int) -> Response:
+    """Compresses the response body with brotli (if installed) or gzip, as accepted by the client"""
+    if len(response.body) < minimum_size:
+        return response
+
+    accepted = {encoding.split(";")[0].strip() for encoding in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        content_encoding, body = "br", brotli.compress(response.body, quality=4)
+    elif "gzip" in accepted:
+        content_encoding, body = "gzip", gzip.compress(response.body, compresslevel=6)
+    else:
+        return response
+
+    response.body = body
+    response.headers["Content-Encoding"] = content_encoding
+    response.headers["Content-Length"] = str(len(body))
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
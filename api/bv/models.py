@@ -1,5 +1,18 @@
+import hashlib
 from pydantic import BaseModel, Field
-from datetime import date
+from datetime import date, datetime
+
+# Searches closer than that (in degrees, about 100m) are considered identical
+FINGERPRINT_PRECISION = 3
+
+
+def round_coordinates(coordinates: str) -> str:
+    try:
+        return ",".join(
+            "{:.{}f}".format(float(c), FINGERPRINT_PRECISION) for c in coordinates.split(",")
+        )
+    except (AttributeError, ValueError):
+        return str(coordinates)
 
 
 class Journey(BaseModel):
@@ -26,6 +39,17 @@ class Journey(BaseModel):
             "nb_passenger": self.nb_passenger
         }
 
+    def fingerprint(self) -> str:
+        """Canonical key of the search: rounded points, day of departure and passengers"""
+        day = datetime.utcfromtimestamp(self.start).date() if self.start is not None else None
+        canonical = "{}|{}|{}|{}".format(
+            round_coordinates(self.origin),
+            round_coordinates(self.destination),
+            day,
+            self.nb_passenger
+        )
+        return hashlib.sha1(canonical.encode()).hexdigest()
+
     class Config:
         schema_extra = {
             "example": {
@@ -0,0 +1,38 @@
+"""Projection of the results payload on the fields needed by the client"""
+from typing import Optional
+
+# Everything but the steps, enough for the journeys list
+SUMMARY = "summary"
+FULL = "full"
+STEPS_FIELD = "journey_steps"
+
+
+def parse_fields(fields: str) -> Optional[set]:
+    """Journey fields to keep, None for all of them"""
+    if fields == FULL:
+        return None
+    if fields == SUMMARY:
+        return {SUMMARY}
+    return {field.strip() for field in fields.split(",") if field.strip()} | {"id"}
+
+
+def project_journey(journey: dict, fields: Optional[set]) -> dict:
+    if fields is None:
+        return journey
+    if SUMMARY in fields:
+        return {k: v for k, v in journey.items() if k != STEPS_FIELD}
+    return {k: v for k, v in journey.items() if k in fields}
+
+
+def project_results(payload: dict, fields: Optional[set]) -> dict:
+    if fields is None or "journeys" not in payload:
+        return payload
+    return dict(payload, journeys=[project_journey(j, fields) for j in payload["journeys"]])
+
+
+def select_journey(payload: dict, journey_id: str) -> Optional[dict]:
+    """Payload with the single journey journey_id, None if there is no such journey"""
+    for journey in payload.get("journeys", []):
+        if journey.get("id") == journey_id:
+            return dict(payload, journeys=[journey])
+    return None
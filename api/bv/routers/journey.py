@@ -1,18 +1,20 @@
-from fastapi import APIRouter, Request, Depends, Form
+from fastapi import APIRouter, Request, Depends, Form, Query, WebSocket
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Union
-from api.bv import models
-from api.bv.celery import Client as Celery
+from api.bv import encoding, models, projection, streaming
+from api.bv.celery import Client as Celery, get_client
 from loguru import logger
 
 router = APIRouter()
 
 @router.post("/journey", tags=["journey"])
-def post_journey(
+async def post_journey(
         origin=Form(default=None, alias="from"),
         destination: Union[str, None] = Form(default=None, alias="to"),
         start: Union[int, None] = Form(default=None),
         nb_passenger: Union[int, None] = Form(default=None),
-        celery: Celery = Depends()):
+        celery: Celery = Depends(get_client)):
     logger.info("Journey requested")
     journey = models.Journey(
         origin=origin,
@@ -20,11 +22,69 @@ def post_journey(
         start=start,
         nb_passenger=nb_passenger
     )
-    r = celery.publish_journey(journey=journey)
+    # Publishing is blocking, keep it out of the event loop
+    r = await run_in_threadpool(celery.publish_journey, journey=journey)
     return {"journey_id": r.id}
 
 
 @router.get("/results", tags=["journey"])
-def get_journey(request_id: str, celery: Celery = Depends()):
-    r = celery.get_result(uuid=request_id)
-    return r
+async def get_journey(
+        request_id: str,
+        request: Request,
+        fields: str = Query(
+            default=projection.FULL,
+            description="`full`, `summary` (without steps) or comma separated journey fields",
+        ),
+        journey_id: Union[str, None] = Query(default=None, description="Only return this journey, in full"),
+        celery: Celery = Depends(get_client)):
+    payload, code = await celery.get_result_async(request.app.redis, uuid=request_id)
+    if journey_id is not None:
+        journey = projection.select_journey(payload, journey_id)
+        if journey is not None:
+            payload = journey
+        elif code == 200:
+            payload, code = {"error": f"Unknown journey {journey_id}"}, 404
+    else:
+        payload = projection.project_results(payload, projection.parse_fields(fields))
+
+    # Already JSON compatible, skip FastAPI encoding pass
+    response = request.app.encoder.response_class((payload, code))
+    return encoding.compress(
+        response, request.headers.get("accept-encoding", ""), request.app.settings.compression_minimum_size
+    )
+
+
+@router.get("/results/stream", tags=["journey"])
+async def stream_journey(request_id: str, request: Request):
+    """Server-Sent Events: a `results` event each time new journeys are available"""
+    app = request.app
+
+    async def events():
+        async for results in streaming.watch_results(
+                app.redis, request_id, timeout=app.settings.results_channel_timeout,
+                decode=app.celery.backend.decode):
+            if await request.is_disconnected():
+                break
+            if results is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: results\ndata: {app.encoder.dumps(results).decode()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/results/ws")
+async def websocket_journey(websocket: WebSocket, request_id: str):
+    """Websocket: a message each time new journeys are available"""
+    app = websocket.app
+    await websocket.accept()
+    async for results in streaming.watch_results(
+            app.redis, request_id, timeout=app.settings.results_channel_timeout,
+            decode=app.celery.backend.decode):
+        if results is not None:
+            await websocket.send_text(app.encoder.dumps(results).decode())
+    await websocket.close()
@@ -10,9 +10,39 @@ class Settings(BaseSettings):
     task_default_exchange: str = "bonvoyage"
     task_default_exchange_type: str = "topic"
     task_default_routing_key: str = "journey.all"
+    # Connections kept open and shared by all requests
+    broker_pool_limit: int = Field(10, env="CELERY_BROKER_POOL_LIMIT")
+    redis_max_connections: int = Field(20, env="CELERY_REDIS_MAX_CONNECTIONS")
 
     # Workers
     workers: str = Field(..., env='WORKERS')
 
+    # Workers time budget in seconds, they return what they have when it is over.
+    # Past the margin, celery interrupts them (soft limit), then kills them.
+    worker_deadline: int = Field(20, env='WORKER_DEADLINE')
+    worker_time_limit_margin: int = Field(5, env='WORKER_TIME_LIMIT_MARGIN')
+
+    # Publish each worker results as soon as they are processed by the broker
+    streaming_results: bool = Field(False, env='STREAMING_RESULTS')
+
+    # Maximum duration of a results push channel (SSE or websocket), in seconds
+    results_channel_timeout: int = Field(120, env='RESULTS_CHANNEL_TIMEOUT')
+
+    # Identical searches submitted within this window (in seconds) share the same
+    # request id instead of launching new workers. 0 disables it.
+    coalescing_window: int = Field(300, env='COALESCING_WINDOW')
+
+    # Serve searches from the journeys cached by the broker, only running again
+    # the workers whose journeys expired (see broker SEARCH_CACHE_TTLS)
+    search_cache: bool = Field(True, env='SEARCH_CACHE')
+    # Lifetime of the results published worker by worker, in seconds
+    partial_results_ttl: int = Field(3600, env='PARTIAL_RESULTS_TTL')
+
+    # JSON encoder of the responses and celery messages: orjson (if installed) or json
+    json_encoder: str = Field('orjson', env='JSON_ENCODER')
+
+    # Results responses larger than that (in bytes) are compressed
+    compression_minimum_size: int = Field(1024, env='COMPRESSION_MINIMUM_SIZE')
+
     class Config:
         env_file = Path("..") / ".env"
@@ -0,0 +1,139 @@
+"""Reading of the results published by the broker, and notification of their updates"""
+import json
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from celery import states
+
+# Streaming mode hash, also used as the channel its updates are published on
+PARTIAL_RESULTS_KEY = "bonvoyage:results:{}"
+WORKER_FIELD_PREFIX = "worker:"
+# Journeys of one worker for a search fingerprint, cached by the broker
+SEARCH_CACHE_KEY = "bonvoyage:search:{}:{}"
+# Celery redis backend key, its updates are published on the same channel
+TASK_META_KEY = "celery-task-meta-{}"
+# Seconds without update before yielding a keep-alive
+KEEP_ALIVE = 5.0
+
+TYPE_PLANE = "Plane"
+
+
+def merge_journeys(journeys_by_worker: dict) -> list:
+    journeys = [
+        journey
+        for worker in sorted(journeys_by_worker)
+        for journey in journeys_by_worker[worker]
+    ]
+
+    # Drop fake plane journeys if we have actual plane trips
+    if any(TYPE_PLANE in j["category"] and j["is_real_journey"] for j in journeys):
+        journeys = [journey for journey in journeys if journey["is_real_journey"]]
+
+    # Scores are generalized costs, comparable between workers
+    journeys.sort(key=lambda journey: journey.get("score") or 0)
+    return journeys
+
+
+def parse_partial_results(record: dict) -> Optional[dict]:
+    """Builds the results payload from the Redis hash written by the broker"""
+    if not record:
+        return None
+
+    record = {
+        (k.decode() if isinstance(k, bytes) else k): v for k, v in record.items()
+    }
+    journeys_by_worker = {
+        field[len(WORKER_FIELD_PREFIX):]: json.loads(value)
+        for field, value in record.items()
+        if field.startswith(WORKER_FIELD_PREFIX)
+    }
+    expected = int(record.get("expected", 0))
+
+    return {
+        "status": "success",
+        "complete": len(journeys_by_worker) >= expected,
+        "version": int(record.get("version", 0)),
+        "workers": sorted(journeys_by_worker),
+        "journeys": merge_journeys(journeys_by_worker),
+    }
+
+
+def get_cached_searches(client, fingerprint: str, workers: list) -> dict:
+    """Cached journeys (still encoded) of each worker, for the workers that have some"""
+    values = client.mget([SEARCH_CACHE_KEY.format(fingerprint, worker) for worker in workers])
+    return {worker: value for worker, value in zip(workers, values) if value is not None}
+
+
+def seed_partial_results(client, uuid: str, journeys_by_worker: dict, nb_workers: int, ttl: int):
+    """Writes journeys (still encoded) as the broker does in streaming mode"""
+    key = PARTIAL_RESULTS_KEY.format(uuid)
+    mapping = {WORKER_FIELD_PREFIX + worker: value for worker, value in journeys_by_worker.items()}
+    mapping["expected"] = nb_workers
+    pipe = client.pipeline()
+    pipe.hset(key, mapping=mapping)
+    pipe.hincrby(key, "version", 1)
+    pipe.expire(key, ttl)
+    pipe.execute()
+
+
+def parse_task_meta(meta: Optional[dict]) -> Optional[dict]:
+    """Builds the results payload from the (decoded) chord result stored by celery"""
+    if meta is None:
+        return None
+
+    if meta["status"] == states.SUCCESS:
+        return dict(meta["result"], complete=True)
+    elif meta["status"] == states.FAILURE:
+        return {"status": "error", "error": meta["result"], "complete": True}
+    return None
+
+
+async def get_partial_results_async(client, uuid: str) -> Optional[dict]:
+    return parse_partial_results(await client.hgetall(PARTIAL_RESULTS_KEY.format(uuid)))
+
+
+async def get_task_meta_async(client, uuid: str, decode: Callable = json.loads) -> Optional[dict]:
+    """Celery result of a task, decode being the backend one"""
+    meta = await client.get(TASK_META_KEY.format(uuid))
+    return decode(meta) if meta is not None else None
+
+
+async def read_results(client, uuid: str, decode: Callable = json.loads) -> Optional[dict]:
+    """Current results of a request, either streamed or computed by a chord"""
+    partial_results = await get_partial_results_async(client, uuid)
+    if partial_results is not None:
+        return partial_results
+    return parse_task_meta(await get_task_meta_async(client, uuid, decode))
+
+
+async def watch_results(
+        client, uuid: str, timeout: float, decode: Callable = json.loads) -> AsyncIterator[Optional[dict]]:
+    """
+    Yields the results each time they are updated, until they are complete.
+    None is yielded when nothing happened for a while, to allow keep-alives.
+    """
+    pubsub = client.pubsub()
+    await pubsub.subscribe(PARTIAL_RESULTS_KEY.format(uuid), TASK_META_KEY.format(uuid))
+    deadline = time.monotonic() + timeout
+    last_event = time.monotonic()
+    try:
+        # Results may have been published before we subscribed
+        results = await read_results(client, uuid, decode)
+        if results is not None:
+            yield results
+
+        while (results is None or not results["complete"]) and time.monotonic() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEP_ALIVE)
+            if message is None:
+                # Subscription confirmations also give None
+                if time.monotonic() - last_event >= KEEP_ALIVE:
+                    last_event = time.monotonic()
+                    yield None
+                continue
+            results = await read_results(client, uuid, decode)
+            if results is not None:
+                last_event = time.monotonic()
+                yield results
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
@@ -1,5 +1,8 @@
 from fastapi import FastAPI
+from redis import asyncio as aioredis
 from .bv.settings import Settings
+from .bv.celery import Client
+from .bv.encoding import Encoder
 from api.bv.routers import journey, tools
 from pathlib import Path
 
@@ -7,9 +10,18 @@ config_path = Path(__file__).with_name("logging_config.json")
 
 
 def create_app() -> FastAPI:
-    api = FastAPI()
+    settings = Settings()
+    encoder = Encoder(settings.json_encoder)
+    api = FastAPI(default_response_class=encoder.response_class)
 
-    api.settings = Settings()
+    api.settings = settings
+    api.encoder = encoder
+    # Celery client shared by all requests, with its connection pools
+    api.celery = Client(settings=api.settings)
+    api.add_event_handler("shutdown", api.celery.close)
+    # Async client on the results backend, for the results push channels
+    api.redis = aioredis.from_url(api.settings.result_backend)
+    api.add_event_handler("shutdown", api.redis.close)
     api.include_router(journey.router)
     api.include_router(tools.router)
 
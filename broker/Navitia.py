@@ -1,10 +1,16 @@
+import os
+
 import pandas as pd
+import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from . import config as tmw_api_keys
 from . import TMW as tmw
 from . import constants
 
 # import folium
+import navitia_client as navitia
 from navitia_client import Client
 from shapely.geometry import Point
 import re
@@ -75,19 +81,64 @@ NAVITIA FUNCTIONS
 """
 
 
+class PooledClient(Client):
+    """
+    Navitia client keeping its connections alive. navitia_client.Client calls
+    requests.get, which opens a new connection (and TLS session) per request,
+    without timeout. Here all requests go through a session whose connection
+    pool is shared by the threads of the process, with timeouts, and retries
+    of 5xx answers done by urllib3.
+    """
+
+    def __init__(self, user, **kwargs):
+        super().__init__(user, **kwargs)
+        self.session = requests.Session()
+        self.session.auth = (user, self.password)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=tmw_api_keys.NAVITIA_POOL_SIZE,
+            max_retries=Retry(
+                total=tmw_api_keys.NAVITIA_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(500, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _get(self, url, extra_params=None, verbose=False, ignore_fail=False, **kwargs):
+        if verbose:
+            logger.debug("Navitia request on {}", url)
+        try:
+            return self.session.get(
+                os.path.join(self.core_url, url),
+                params=extra_params or {},
+                timeout=(tmw_api_keys.NAVITIA_CONNECT_TIMEOUT, tmw_api_keys.NAVITIA_READ_TIMEOUT),
+            )
+        except requests.exceptions.Timeout:
+            if ignore_fail:
+                return False
+            raise navitia.exceptions.Timeout()
+        except requests.exceptions.RequestException as e:
+            if ignore_fail:
+                return False
+            raise navitia.exceptions.TransportError(e)
+
+
 def start_navitia_client():
     navitia_api_key = tmw_api_keys.NAVITIA_API_KEY
-    navitia_client = Client(user=navitia_api_key)
+    navitia_client = PooledClient(user=navitia_api_key)
     return navitia_client
 
 
 # ATTENTION: C'est quoi ce bout de code. Pas très propre... Doit être dans le main.py?
+# Shared by all the tasks and threads of the process
 navitia_client = start_navitia_client()
 _NAVITIA_COV = get_navitia_coverage(navitia_client)
 
 
 def navitia_query_directions(query, _id=0):
-    navitia_client = start_navitia_client()
     start = query.start_point
     end = query.end_point
     try:
@@ -104,7 +155,11 @@ def navitia_query_directions(query, _id=0):
     url = f"coverage/{navitia_region}/journeys?from={start_coord}&to={end_coord}"
     url = url + "&data_freshness=base_schedule&max_nb_journeys=3"
 
-    step = navitia_client.raw(url, multipage=False)
+    try:
+        step = navitia_client.raw(url, multipage=False)
+    except (navitia.exceptions.Timeout, navitia.exceptions.TransportError) as e:
+        logger.warning(f"Navitia unavailable for {url}: {e!r}")
+        return None
     if step.status_code == 200:
         return navitia_journeys(step.json())
         # return step.json()
@@ -137,7 +192,6 @@ def navitia_query_directions(query, _id=0):
 
 # UTILISER DANS LA CLASSE POINT DE TMW, MAIS CETTE CLASSE EST UTILISéE NUL PART, A SUPPRIMER?
 def navitia_coverage_gpspoint(lon, lat):  #
-    navitia_client = start_navitia_client()
     cov = navitia_client.raw(
         "coverage/{};{}".format(lon, lat), multipage=False, page_limit=10, verbose=True
     )
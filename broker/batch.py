@@ -0,0 +1,132 @@
+"""
+JOURNEY BATCH
+
+Columnar view of a list of journeys: step attributes are flattened into NumPy
+arrays (one value per step, with the offsets of each journey), so that the
+broker aggregates hundreds of journeys with a few array operations instead of
+looping over the steps of every journey.
+"""
+import numpy as np
+
+from .TMW import MAIN_TYPES, URBAN_TYPES
+
+TYPES = MAIN_TYPES + URBAN_TYPES
+TYPE_CODES = {_type: code for code, _type in enumerate(TYPES)}
+# Indexed by type code, other types having code -1 (last item)
+_IS_MAIN = np.array([t in MAIN_TYPES for t in TYPES] + [False])
+_IS_URBAN = np.array([t in URBAN_TYPES for t in TYPES] + [False])
+_IS_VEHICLE = _IS_MAIN | _IS_URBAN
+
+
+def _column(values, dtype=np.float64):
+    # Missing values count as 0, as in Journey.update()
+    return np.nan_to_num(np.array(values, dtype=np.float64), nan=0).astype(dtype, copy=False)
+
+
+class JourneyBatch:
+    def __init__(self, journeys: list):
+        self.journeys = journeys
+        self.steps = [step for journey in journeys for step in journey.steps]
+        nb_journeys = len(journeys)
+        nb_steps = len(self.steps)
+
+        self.nb_steps = np.fromiter((len(j.steps) for j in journeys), dtype=np.int64, count=nb_journeys)
+        self.offsets = np.concatenate(([0], np.cumsum(self.nb_steps)))
+        # Journey index of each step
+        self.step_journey = np.repeat(np.arange(nb_journeys), self.nb_steps)
+
+        steps = self.steps
+        self.types = np.array([TYPE_CODES.get(s.type, -1) for s in steps], dtype=np.int64)
+        self.distances = _column([s.distance_m for s in steps])
+        self.durations = _column([s.duration_s for s in steps])
+        self.gCO2 = _column([s.gCO2 for s in steps])
+        self.departure_dates = _column([s.departure_date for s in steps], np.int64)
+        self.arrival_dates = _column([s.arrival_date for s in steps], np.int64)
+        self.bike_friendly = np.array([bool(s.bike_friendly) for s in steps], dtype=bool)
+        # Prices are lists per step, flattened with the number of prices of each step.
+        # They are rounded first, as in Journey.update()
+        self.nb_prices = np.array([len(s.price_EUR) for s in steps], dtype=np.int64)
+        self.price_items = np.round(_column([p for s in steps for p in s.price_EUR]), 2)
+        self.prices = np.bincount(
+            np.repeat(np.arange(nb_steps), self.nb_prices), weights=self.price_items, minlength=nb_steps
+        )
+        self.is_real_journey = np.fromiter(
+            (bool(j.is_real_journey) for j in journeys), dtype=bool, count=nb_journeys
+        )
+
+    def __len__(self):
+        return len(self.journeys)
+
+    def _per_journey(self, values):
+        return np.bincount(self.step_journey, weights=values, minlength=len(self))
+
+    def has_type(self, _type) -> np.ndarray:
+        """Whether each journey has at least one step of the type"""
+        return self._per_journey(self.types == TYPE_CODES[_type]) > 0
+
+    def has_real_journey(self, _type) -> bool:
+        """Whether a real journey (not an estimation) has a step of the type"""
+        return bool(np.any(self.is_real_journey & self.has_type(_type)))
+
+    def nb_transfers(self) -> np.ndarray:
+        """Changes of vehicle of each journey, walking and waiting steps excluded"""
+        return np.maximum(self._per_journey(_IS_VEHICLE[self.types]) - 1, 0)
+
+    def objectives(self) -> np.ndarray:
+        """Costs to minimize, one row per journey: duration (s), price (EUR), gCO2 and transfers"""
+        return np.column_stack((
+            self._per_journey(self.durations),
+            np.round(self._per_journey(self.prices), 2),
+            self._per_journey(self.gCO2),
+            self.nb_transfers(),
+        ))
+
+    def select(self, mask) -> list:
+        return [journey for journey, keep in zip(self.journeys, mask) if keep]
+
+    def _split(self, mask) -> list:
+        # Types of the masked steps, grouped by journey
+        counts = np.bincount(self.step_journey[mask], minlength=len(self))
+        offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+        types = [TYPES[c] for c in self.types[mask].tolist()]
+        return [types[offsets[i]:offsets[i + 1]] for i in range(len(self))]
+
+    def categories(self) -> list:
+        """Main step types in steps order, or the distinct urban ones if there are none"""
+        main = self._split(_IS_MAIN[self.types])
+        urban = self._split(_IS_URBAN[self.types])
+        return [m if len(m) > 0 else list(set(u)) for m, u in zip(main, urban)]
+
+    def update(self):
+        """Journey.update() for all the journeys at once"""
+        total_distance = self._per_journey(self.distances).tolist()
+        total_duration = self._per_journey(self.durations).tolist()
+        total_price = np.round(self._per_journey(self.prices), 2).tolist()
+        total_gCO2 = self._per_journey(self.gCO2).tolist()
+        bike_friendly = (self._per_journey(~self.bike_friendly) == 0).tolist()
+        categories = self.categories()
+        # Dates of the first and last steps, only used for journeys having steps
+        last = len(self.steps) - 1
+        departure_dates = self.departure_dates[self.offsets[:-1].clip(max=last)].tolist() if last >= 0 else []
+        arrival_dates = self.arrival_dates[(self.offsets[1:] - 1).clip(min=0)].tolist() if last >= 0 else []
+
+        for i, journey in enumerate(self.journeys):
+            journey.score = 0
+            journey.total_distance = total_distance[i]
+            journey.total_duration = total_duration[i]
+            journey.total_price_EUR = total_price[i]
+            journey.total_gCO2 = total_gCO2[i]
+            journey.bike_friendly = bike_friendly[i]
+            if len(journey.steps) > 0:
+                journey.departure_point = journey.steps[0].departure_point
+                journey.arrival_point = journey.steps[-1].arrival_point
+                journey.departure_date = departure_dates[i]
+                journey.arrival_date = arrival_dates[i]
+                journey.category = categories[i]
+
+        prices = self.price_items.tolist()
+        offset = 0
+        for step, nb_prices in zip(self.steps, self.nb_prices.tolist()):
+            step.price_EUR[:] = prices[offset:offset + nb_prices]
+            offset += nb_prices
+        return self
@@ -0,0 +1,100 @@
+"""
+URBAN LEGS CACHE
+
+Station to city legs are the same for a lot of requests, so their results are
+cached in two tiers: a per process LRU, then an optional Redis tier shared by
+all broker processes. Both tiers are bounded by age, the LRU also by size.
+Values must be JSON serializable.
+"""
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import redis
+from loguru import logger
+
+from . import config
+
+
+class UrbanLegCache:
+    def __init__(self, max_size, ttl, redis_client=None, prefix="bonvoyage:urban"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis = redis_client
+        self.prefix = prefix
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0}
+        # key -> (expiration time, value), least recently used first
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(provider, profile, start_point, end_point, departure_date, bucket_s):
+        """Key on rounded points and on a departure time bucket"""
+        bucket = int(departure_date) // bucket_s if departure_date is not None else ""
+        return "{}:{}:{:.4f},{:.4f}:{:.4f},{:.4f}:{}".format(
+            provider, profile, start_point[0], start_point[1], end_point[0], end_point[1], bucket
+        )
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats["local_hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+                self.stats["evictions"] += 1
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(f"{self.prefix}:{key}")
+            except redis.RedisError as e:
+                logger.warning("Urban cache unavailable on Redis: {}", e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._set_local(key, value)
+                with self._lock:
+                    self.stats["redis_hits"] += 1
+                return value
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self.redis is not None:
+            try:
+                self.redis.set(f"{self.prefix}:{key}", json.dumps(value), ex=self.ttl)
+            except redis.RedisError as e:
+                logger.warning("Urban cache unavailable on Redis: {}", e)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+
+def make_urban_cache():
+    redis_client = None
+    if config.URBAN_CACHE_REDIS_URL:
+        redis_client = redis.Redis.from_url(
+            config.URBAN_CACHE_REDIS_URL, socket_timeout=config.URBAN_CACHE_REDIS_TIMEOUT
+        )
+    return UrbanLegCache(
+        max_size=config.URBAN_CACHE_SIZE, ttl=config.URBAN_CACHE_TTL, redis_client=redis_client
+    )
+
+
+urban_cache = make_urban_cache()
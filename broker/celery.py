@@ -1,6 +1,8 @@
 from celery import Celery
 import os
 
+from worker import wire
+
 
 def make_app(name: str) -> Celery:
     clry = Celery("bonvoyage")
@@ -10,6 +12,12 @@ def make_app(name: str) -> Celery:
     clry.conf.task_default_exchange_type = "topic"
     clry.conf.task_default_queue = name
     clry.conf.task_default_routing_key = f"journey.{name}"
+    # Workers may send their results in any of these (see WIRE_FORMAT)
+    clry.conf.accept_content = ["json", "msgpack", wire.SERIALIZER]
+    clry.conf.result_accept_content = ["json", "msgpack", wire.SERIALIZER]
+    # Journeys sent to the API are encoded (and JSON messages decoded) by orjson if installed
+    if wire.orjson is not None and wire.register_orjson():
+        clry.conf.result_serializer = wire.ORJSON
     clry.autodiscover_tasks(packages=["broker"])
 
     return clry
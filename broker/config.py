@@ -13,3 +13,56 @@ SKYSCANNER_API_KEY = os.getenv("SKYSCANNER_API_KEY")
 SKYSCANNER_RAPIDAPI_KEY = os.getenv("SKYSCANNER_RAPIDAPI_KEY")
 KOMBO_API_KEY = os.getenv("KOMBO_API_KEY")
 BLABLACAR_API_KEY = os.getenv("BLABLACAR_API_KEY")
+
+# Urban legs (first/last mile) resolution
+URBAN_QUERIES_MAX_WORKERS = int(os.getenv("URBAN_QUERIES_MAX_WORKERS", 8))
+NAVITIA_MAX_CONCURRENCY = int(os.getenv("NAVITIA_MAX_CONCURRENCY", 4))
+ORS_MAX_CONCURRENCY = int(os.getenv("ORS_MAX_CONCURRENCY", 4))
+
+# Navitia HTTP connections, kept alive and shared by the threads of a broker process
+NAVITIA_POOL_SIZE = int(os.getenv("NAVITIA_POOL_SIZE", 8))
+NAVITIA_CONNECT_TIMEOUT = float(os.getenv("NAVITIA_CONNECT_TIMEOUT", 3.05))
+NAVITIA_READ_TIMEOUT = float(os.getenv("NAVITIA_READ_TIMEOUT", 10))
+NAVITIA_RETRIES = int(os.getenv("NAVITIA_RETRIES", 2))
+
+# Urban legs cache
+URBAN_CACHE_SIZE = int(os.getenv("URBAN_CACHE_SIZE", 2048))
+URBAN_CACHE_TTL = int(os.getenv("URBAN_CACHE_TTL", 6 * 3600))
+URBAN_CACHE_BUCKET = int(os.getenv("URBAN_CACHE_BUCKET", 15 * 60))
+# Shared tier, defaults to the celery result backend (set it empty to disable)
+URBAN_CACHE_REDIS_URL = os.getenv("URBAN_CACHE_REDIS_URL", os.getenv("CELERY_RESULT_BACKEND"))
+URBAN_CACHE_REDIS_TIMEOUT = float(os.getenv("URBAN_CACHE_REDIS_TIMEOUT", 0.5))
+
+# Streaming mode, lifetime of partial results in seconds
+PARTIAL_RESULTS_TTL = int(os.getenv("PARTIAL_RESULTS_TTL", 3600))
+
+# Completed searches cache, lifetime of each worker journeys in seconds (0 disables it).
+# Static datasets stay valid much longer than live prices.
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 300))
+SEARCH_CACHE_TTLS = {
+    worker: int(ttl)
+    for worker, ttl in (
+        item.split("=")
+        for item in os.getenv("SEARCH_CACHE_TTLS", "planes=21600,ferries=21600").split(",")
+        if item
+    )
+}
+
+# Ranking, weights of the objectives in euros per hour, euro, kg of CO2 and transfer
+RANKING_WEIGHTS = {
+    objective: float(weight)
+    for objective, weight in (
+        item.split("=")
+        for item in os.getenv("RANKING_WEIGHTS", "duration=10,price=1,gCO2=0.05,transfers=5").split(",")
+        if item
+    )
+}
+# Non-dominated journeys kept (0 keeps all the journeys), plus diverse dominated ones
+RANKING_MAX_RESULTS = int(os.getenv("RANKING_MAX_RESULTS", 20))
+RANKING_MAX_DIVERSE = int(os.getenv("RANKING_MAX_DIVERSE", 5))
+# Interurban journeys whose urban legs are resolved, after dropping the dominated ones (0 for no limit)
+PRUNING_MAX_CANDIDATES = int(os.getenv("PRUNING_MAX_CANDIDATES", 60))
+
+# Logging of the journeys returned: one payload in PAYLOAD_LOG_SAMPLING (0 for none), truncated
+PAYLOAD_LOG_SAMPLING = int(os.getenv("PAYLOAD_LOG_SAMPLING", 0))
+PAYLOAD_LOG_MAX_SIZE = int(os.getenv("PAYLOAD_LOG_MAX_SIZE", 2000))
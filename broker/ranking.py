@@ -0,0 +1,150 @@
+"""
+RANKING
+
+Journeys are compared on four objectives to minimize: duration, price, gCO2 and
+number of transfers. Only the Pareto front is kept (journeys no other journey
+beats on every objective), capped to the best ones, plus the best journey of
+each category (e.g. train only, coach) missing from it, so that the answer
+stays diverse.
+
+Interurban journeys are also pruned before their urban legs are resolved (see
+prune), so that Navitia and ORS are only queried for credible candidates.
+
+The score of a journey is its generalized cost, the weighted sum of its
+objectives in euros: lower is better. Being absolute, scores of journeys
+ranked separately (e.g. per worker in streaming mode) can be compared.
+"""
+import numpy as np
+
+from . import config
+from .batch import JourneyBatch
+
+OBJECTIVES = ("duration", "price", "gCO2", "transfers")
+# Units of the weights, per objective: hour, euro, kg of CO2 and transfer
+_UNITS = np.array([3600.0, 1.0, 1000.0, 1.0])
+
+
+def weights_vector(weights: dict) -> np.ndarray:
+    return np.array([float(weights.get(objective, 0)) for objective in OBJECTIVES])
+
+
+def generalized_costs(costs: np.ndarray, weights: dict) -> np.ndarray:
+    return (costs / _UNITS) @ weights_vector(weights)
+
+
+def pareto_front(costs: np.ndarray) -> np.ndarray:
+    """Mask of the rows not dominated by another row (lower or equal on all objectives, lower on one)"""
+    # [j, i]: row j is lower or equal (resp. lower) than row i
+    lower_or_equal = np.all(costs[:, None, :] <= costs[None, :, :], axis=2)
+    lower = np.any(costs[:, None, :] < costs[None, :, :], axis=2)
+    return ~np.any(lower_or_equal & lower, axis=0)
+
+
+def select(costs: np.ndarray, scores: np.ndarray, categories: list, max_results: int, max_diverse: int) -> list:
+    """Indices of the journeys to keep, best scores first"""
+    by_score = np.argsort(scores, kind="stable")
+    if max_results <= 0:
+        return by_score.tolist()
+
+    front = by_score[pareto_front(costs)[by_score]].tolist()
+    if len(front) > max_results:
+        # Best journey on each objective first, so that the cap keeps the ends of the front
+        ends = [front[int(np.argmin(costs[front, k]))] for k in range(costs.shape[1])]
+        front = list(dict.fromkeys(front[:1] + ends + front))[:max_results]
+
+    seen = {tuple(categories[i]) for i in front}
+    diverse = list()
+    for i in by_score.tolist():
+        if len(diverse) >= max_diverse:
+            break
+        category = tuple(categories[i])
+        if category not in seen:
+            seen.add(category)
+            diverse.append(i)
+
+    return sorted(front + diverse, key=lambda i: scores[i])
+
+
+def rank(journeys: JourneyBatch, weights: dict = None, max_results: int = None, max_diverse: int = None) -> list:
+    """
+    Scores the (updated) journeys of the batch and returns the ones to keep,
+    best scores first.
+    """
+    if len(journeys) == 0:
+        return list()
+
+    costs = journeys.objectives()
+    scores = np.round(generalized_costs(costs, config.RANKING_WEIGHTS if weights is None else weights), 2)
+    for journey, score in zip(journeys.journeys, scores.tolist()):
+        journey.score = score
+
+    indices = select(
+        costs,
+        scores,
+        [journey.category for journey in journeys.journeys],
+        config.RANKING_MAX_RESULTS if max_results is None else max_results,
+        config.RANKING_MAX_DIVERSE if max_diverse is None else max_diverse,
+    )
+    return [journeys.journeys[i] for i in indices]
+
+
+def prune(journeys: JourneyBatch, groups: list, max_candidates: int = None) -> list:
+    """
+    Interurban journeys worth resolving the urban legs of. groups are the keys
+    of the urban legs of each journey: journeys of a group get the same urban
+    legs, so dominated journeys and duplicates there stay so once complete, and
+    are dropped, except the best journey of each category that rank() may keep
+    for diversity. The rest is capped to max_candidates, the Pareto front, the
+    diverse journeys and then the best scores first.
+    """
+    max_candidates = config.PRUNING_MAX_CANDIDATES if max_candidates is None else max_candidates
+    if len(journeys) == 0 or config.RANKING_MAX_RESULTS <= 0:
+        return list(journeys.journeys)
+
+    costs = journeys.objectives()
+    categories = journeys.categories()
+    all_scores = generalized_costs(costs, config.RANKING_WEIGHTS)
+    keep = np.zeros(len(journeys), dtype=bool)
+    members = dict()
+    for i, group in enumerate(groups):
+        members.setdefault(group, list()).append(i)
+    for indices in members.values():
+        indices = np.array(indices)
+        on_front = pareto_front(costs[indices])
+        front = indices[on_front]
+        if config.RANKING_MAX_DIVERSE > 0:
+            # Best dominated journey of each category, that rank() may pick for diversity
+            best = dict()
+            dominated = indices[~on_front]
+            for i in dominated[np.argsort(all_scores[dominated], kind="stable")].tolist():
+                best.setdefault(tuple(categories[i]), i)
+            front = np.concatenate((front, np.array(list(best.values()), dtype=front.dtype)))
+        # Duplicates: same trip (costs, category and dates) e.g. sold twice, the same
+        # trip at another time is a different option
+        unique = {
+            (
+                tuple(costs[i].tolist()),
+                tuple(categories[i]),
+                journeys.journeys[i].departure_date,
+                journeys.journeys[i].arrival_date,
+            ): i
+            for i in front[::-1].tolist()
+        }
+        keep[list(unique.values())] = True
+
+    candidates = np.flatnonzero(keep)
+    if 0 < max_candidates < len(candidates):
+        scores = generalized_costs(costs[candidates], config.RANKING_WEIGHTS)
+        selected = select(
+            costs[candidates],
+            scores,
+            [categories[i] for i in candidates.tolist()],
+            max_candidates,
+            config.RANKING_MAX_DIVERSE,
+        )
+        chosen = set(selected)
+        others = [i for i in np.argsort(scores, kind="stable").tolist() if i not in chosen]
+        selected = (selected + others)[:max_candidates]
+        candidates = np.sort(candidates[selected])
+
+    return [journeys.journeys[i] for i in candidates.tolist()]
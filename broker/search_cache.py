@@ -0,0 +1,33 @@
+"""
+COMPLETED SEARCHES CACHE
+
+The final journeys of each worker are cached per search fingerprint (computed by
+the API), so that the API can serve identical searches straight from Redis and
+only run again the workers whose journeys went stale. Each worker has its own
+lifetime, see SEARCH_CACHE_TTLS.
+"""
+import json
+
+import redis
+from loguru import logger
+
+from . import config
+
+SEARCH_CACHE_KEY = "bonvoyage:search:{}:{}"
+
+
+def search_cache_ttl(worker):
+    return config.SEARCH_CACHE_TTLS.get(worker, config.SEARCH_CACHE_TTL)
+
+
+def store_search_results(client, fingerprint, journeys_by_worker):
+    """Caches the journeys of each worker, failures are only logged"""
+    pipe = client.pipeline()
+    for worker, journeys in journeys_by_worker.items():
+        ttl = search_cache_ttl(worker)
+        if ttl > 0:
+            pipe.set(SEARCH_CACHE_KEY.format(fingerprint, worker), json.dumps(journeys), ex=ttl)
+    try:
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Search cache unavailable on Redis: {}", e)
@@ -0,0 +1,27 @@
+"""
+STREAMING RESULTS
+
+In streaming mode, each worker payload is processed by the broker as soon as it
+arrives. Its journeys are stored in a per request Redis hash (one field per
+worker) along with the number of expected workers and a version counter
+incremented on every update. The API merges the stored journeys on read.
+Every update is also published on a channel named after the hash, for the API
+push channels.
+"""
+import json
+
+from . import config
+
+PARTIAL_RESULTS_KEY = "bonvoyage:results:{}"
+WORKER_FIELD = "worker:{}"
+
+
+def store_partial_results(client, request_id, worker, journeys, nb_workers):
+    """Stores the journeys computed for one worker, returns the new version"""
+    key = PARTIAL_RESULTS_KEY.format(request_id)
+    pipe = client.pipeline()
+    pipe.hset(key, mapping={WORKER_FIELD.format(worker): json.dumps(journeys), "expected": nb_workers})
+    pipe.hincrby(key, "version", 1)
+    pipe.expire(key, config.PARTIAL_RESULTS_TTL)
+    pipe.publish(key, worker)
+    return pipe.execute()[1]
@@ -3,13 +3,22 @@ from loguru import logger
 from datetime import datetime as dt
 from . import app
 from broker import wrappers
-from . import Navitia
 from . import TMW
 from . import constants
-from worker.ors.tasks import ors_query_directions
+from . import urban
+from . import streaming
+from . import search_cache
+from . import batch
+from . import ranking
+from worker import wire
 
 
 def recreate_journey_objects(results_list, id_journey=0):
+    if isinstance(results_list, wire.JourneyColumns):
+        # Built straight from the columns, without intermediate dicts
+        journey_list = results_list.to_journeys(id_journey)
+        return journey_list, id_journey + len(journey_list)
+
     # # logger.info('into recreate_journey_objects')
     # # logger.info(results_list)
     journey_list = list()
@@ -22,57 +31,22 @@ def recreate_journey_objects(results_list, id_journey=0):
 
 
 def json_to_journey(json_journey, id_journey):
-    step_list = list()
-    # logger.info('into json_to_journey')
-    # logger.info(type(json_journey))
-    # logger.info(json_journey)
-    id_journey_step = 0
-    for step in json_journey["journey_steps"]:
-        step_list.append(
-            TMW.Journey_step(
-                id_journey_step,
-                _type=step["type"],
-                label=step["label"],
-                distance_m=float(step["distance_m"]),
-                duration_s=float(step["duration_s"]),
-                price_EUR=step["price_EUR"],
-                departure_point=step["departure_point"],
-                arrival_point=step["arrival_point"],
-                departure_stop_name=step["departure_stop_name"],
-                arrival_stop_name=step["arrival_stop_name"],
-                departure_date=int(step["departure_date"]),
-                arrival_date=int(step["arrival_date"]),
-                gCO2=float(step["gCO2"]),
-                booking_link=step["booking_link"],
-                # bike_friendly=step['bike_friendly'],
-            )
-        )
-        id_journey_step += 1
-    journey = TMW.Journey(
-        id_journey,
-        steps=step_list,
-        departure_date=int(json_journey["departure_date"]),
-        arrival_date=int(json_journey["arrival_date"]),
-        booking_link=json_journey["booking_link"],
-    )
+    return TMW.Journey.from_json(json_journey, id_journey)
 
-    journey.category = json_journey["category"]
-    journey.is_real_journey = json_journey["is_real_journey"]
-    return journey
-
-
-@app.task(name="broker", bind=True)
-@wrappers.catch(timing=True)
-def compute_results(results: list, from_loc: str, to_loc: str, start_date: str, nb_passenger: str) -> list:
-    logger.info("Got request: from={} to={} start={} nb_passenger={}", from_loc, to_loc,
-                start_date, nb_passenger)
 
-    # Extract successful results from lists
-    partials = [r for r in results if r["status"] == "success"]
-    # logger.info(partials)
+def build_journeys(partials: list, from_loc: str, to_loc: str, start_date: str, nb_passenger: str,
+                   by_worker: bool = False):
+    """
+    Turns workers successful payloads into complete journeys, urban legs included.
+    With by_worker, journeys are pruned and ranked per worker, as if each worker
+    was alone, and returned per worker in the order of the payloads along with
+    all of them ranked together.
+    """
     content = {}
 
     journey_list = list()
+    # Worker of each journey
+    journey_workers = dict()
 
     geoloc_dep = from_loc.split(",")
     geoloc_dep[0] = float(geoloc_dep[0])
@@ -89,6 +63,8 @@ def compute_results(results: list, from_loc: str, to_loc: str, start_date: str,
             )
             journey_list = journey_list + journey_to_add
             id_journey += 1
+            for journey in journey_to_add:
+                journey_workers[id(journey)] = o["worker"]
         except Exception as e:
             logger.error(
                 "recreate_journey_objects a foiré pour {}: {}", o["emitter"], e
@@ -96,20 +72,22 @@ def compute_results(results: list, from_loc: str, to_loc: str, start_date: str,
 
         worker_name = o["worker"]
         logger.info("Got {} journeys from {}", len(o["result"]), worker_name)
+        if o["status"] == "partial":
+            logger.warning("{} ran out of time, its journeys are partial", worker_name)
         content[worker_name] = o["result"]
 
-    urban_queries = list()
-    urban_queries_json = list()
+    # Urban queries indexed by their key, to resolve each of them only once
+    urban_queries = dict()
+    # Keys of the departure and arrival urban queries of each journey
+    journey_query_keys = dict()
     logger.info(f"on a {len(journey_list)} journey")
 
-    plane_from_kombo = False
+    # Get rid of fake plane journeys if we have actual plane trips from kombo,
+    # before asking for their urban legs
+    if batch.JourneyBatch(journey_list).has_real_journey(constants.TYPE_PLANE):
+        journey_list = [journey for journey in journey_list if journey.is_real_journey]
 
     for interurban_journey in journey_list:
-        # prepare to get rid of fake plane journeys if we have actual plane trips from kombo
-        if constants.TYPE_PLANE in interurban_journey.category:
-            if interurban_journey.is_real_journey:
-                plane_from_kombo = True
-
         # create the intra_urban queries for Naviitia
         if len(interurban_journey.steps[0].departure_point) == 1:
             logger.warning("mauvais trip")
@@ -120,69 +98,50 @@ def compute_results(results: list, from_loc: str, to_loc: str, start_date: str,
             interurban_journey.steps[0].departure_point,
             int(start_date),
         )
-        if query_dep.to_json() not in urban_queries_json:
-            urban_queries.append(query_dep)
-            urban_queries_json.append(query_dep.to_json())
         query_arr = TMW.Query(
             0,
             interurban_journey.steps[-1].arrival_point,
             geoloc_arr,
             int(start_date),
         )
+        key_dep = query_dep.key()
+        key_arr = query_arr.key()
+        urban_queries.setdefault(key_dep, query_dep)
+        urban_queries.setdefault(key_arr, query_arr)
+        journey_query_keys[id(interurban_journey)] = (key_dep, key_arr)
 
-        if query_arr.to_json() not in urban_queries_json:
-            urban_queries.append(query_arr)
-            urban_queries_json.append(query_arr.to_json())
+    def prune(journeys):
+        return ranking.prune(
+            batch.JourneyBatch(journeys),
+            [journey_query_keys[id(journey)] for journey in journeys],
+        )
 
-    # Drop fake journeys if we can
-    if plane_from_kombo:
-        journey_list = [journey for journey in journey_list if journey.is_real_journey]
+    # Drop the candidates that cannot make it to the answer before asking for their urban legs
+    nb_journeys = len(journey_list)
+    journey_list = per_worker(journey_list, journey_workers, prune) if by_worker else prune(journey_list)
+    needed_keys = {key for journey in journey_list for key in journey_query_keys[id(journey)]}
+    urban_queries = {key: query for key, query in urban_queries.items() if key in needed_keys}
+    logger.info("Kept {} candidate journeys out of {}", len(journey_list), nb_journeys)
 
-    # urban_queries = list(set(urban_queries))
     logger.info(f"Got {len(urban_queries)} urban queries")
 
     urban_journey_dict = dict()
     departure_point_name = "Départ"
     arrival_point_name = "Arrivé"
-    for urban_query in urban_queries:
-        urban_journey = Navitia.navitia_query_directions(urban_query)
-
-        if urban_journey is None and urban_query.start_point != urban_query.end_point:
-            urban_journey = list()
-            urban_journey.append(
-                ors_query_directions(
-                    {
-                        "start_point": urban_query.start_point,
-                        "end_point": urban_query.end_point,
-                        "departure_date": int(urban_query.departure_date),
-                        "nb_passenger": nb_passenger
-                    },
-                    avoid_ferries=False,
-                )
-            )
-        elif urban_journey is not None:
+    urban_journeys = urban.resolve_urban_queries(list(urban_queries.values()), nb_passenger)
+    for (key, urban_query), (provider, urban_journey) in zip(urban_queries.items(), urban_journeys):
+        if provider == urban.PROVIDER_NAVITIA:
             if urban_query.start_point == geoloc_dep:
                 departure_point_name = urban_journey[0].steps[0].departure_stop_name
             elif urban_query.end_point == geoloc_arr:
                 arrival_point_name = urban_journey[0].steps[-1].arrival_stop_name
 
-        urban_journey_dict[str(urban_query.to_json())] = urban_journey
+        urban_journey_dict[key] = urban_journey
 
     for interurban_journey in journey_list:
-        json_key_start = TMW.Query(
-            0,
-            geoloc_dep,
-            interurban_journey.steps[0].departure_point,
-            int(start_date),
-        ).to_json()
-        start_to_station_steps = urban_journey_dict[str(json_key_start)]
-        json_key_end = TMW.Query(
-            0,
-            interurban_journey.steps[-1].arrival_point,
-            geoloc_arr,
-            int(start_date),
-        ).to_json()
-        station_to_arrival_steps = urban_journey_dict[str(json_key_end)]
+        key_dep, key_arr = journey_query_keys[id(interurban_journey)]
+        start_to_station_steps = urban_journey_dict[key_dep]
+        station_to_arrival_steps = urban_journey_dict[key_arr]
 
         if (start_to_station_steps is not None) & (
             station_to_arrival_steps is not None
@@ -204,7 +163,10 @@ def compute_results(results: list, from_loc: str, to_loc: str, start_date: str,
                         station_to_arrival_steps[0], start_end=False
                     )
 
-        interurban_journey.update()
+    # Totals and categories of all the journeys at once
+    journeys_batch = batch.JourneyBatch(journey_list).update()
+
+    for interurban_journey in journey_list:
         # create stop names for ors
         for step_nb in range(len(interurban_journey.steps)):
             step = interurban_journey.steps[step_nb]
@@ -218,10 +180,113 @@ def compute_results(results: list, from_loc: str, to_loc: str, start_date: str,
                 else:
                     step.arrival_stop_name = interurban_journey.steps[step_nb+1].departure_stop_name
 
+    # Scores, drops dominated journeys and sorts the rest, best first
+    nb_journeys = len(journey_list)
+    if by_worker:
+        # Journeys of each worker ranked without the others, so that they can be cached
+        journey_list = per_worker(
+            journey_list, journey_workers, lambda journeys: ranking.rank(batch.JourneyBatch(journeys))
+        )
+        response = {o["worker"]: list() for o in partials}
+        for journey in journey_list:
+            worker = journey_workers[id(journey)]
+            response[worker].append(journey_to_json(journey, worker))
+        wrappers.log_payload("Journeys by worker", response)
+
+        journey_list = ranking.rank(batch.JourneyBatch(journey_list))
+        logger.info("Kept {} ranked journeys out of {}", len(journey_list), nb_journeys)
+        merged = [journey_to_json(journey, journey_workers[id(journey)]) for journey in journey_list]
+        return response, merged
+
+    journey_list = ranking.rank(journeys_batch)
+    logger.info("Kept {} ranked journeys out of {}", len(journey_list), nb_journeys)
+
     response = list()
 
     for journey in journey_list:
-        # response[journey.id] = journey.to_json()
-        response.append(journey.to_json())
-    logger.info(response)
+        response.append(journey_to_json(journey, journey_workers[id(journey)]))
+    wrappers.log_payload("Journeys", response)
+    return response
+
+
+def per_worker(journey_list: list, journey_workers: dict, func) -> list:
+    """Applies func to the journeys of each worker separately, results in the order of the workers"""
+    journeys_by_worker = dict()
+    for journey in journey_list:
+        journeys_by_worker.setdefault(journey_workers[id(journey)], list()).append(journey)
+    return [journey for journeys in journeys_by_worker.values() for journey in func(journeys)]
+
+
+def journey_to_json(journey, worker: str) -> dict:
+    """Journey payload, with an id that stays the same whenever the results are read"""
+    payload = journey.to_json()
+    payload["id"] = f"{worker}:{journey.id}"
+    return payload
+
+
+def cache_search_results(fingerprint: str, partials: list, journeys_by_worker: dict):
+    """Caches the journeys of the workers which were not out of time"""
+    complete = {o["worker"] for o in partials if o["status"] == "success"}
+    search_cache.store_search_results(
+        app.backend.client,
+        fingerprint,
+        {worker: journeys for worker, journeys in journeys_by_worker.items() if worker in complete},
+    )
+
+
+@app.task(name="broker", bind=True)
+@wrappers.catch(timing=True)
+def compute_results(results: list, from_loc: str, to_loc: str, start_date: str, nb_passenger: str,
+                    fingerprint: str = None) -> list:
+    logger.info("Got request: from={} to={} start={} nb_passenger={}", from_loc, to_loc,
+                start_date, nb_passenger)
+
+    # Extract successful results from lists, partial ones being workers out of time
+    partials = [r for r in results if r["status"] in ("success", "partial")]
+    if fingerprint is None:
+        return build_journeys(partials, from_loc, to_loc, start_date, nb_passenger)
+
+    journeys_by_worker, journeys = build_journeys(
+        partials, from_loc, to_loc, start_date, nb_passenger, by_worker=True
+    )
+    cache_search_results(fingerprint, partials, journeys_by_worker)
+    return journeys
+
+
+@app.task(name="broker.partial", bind=True, ignore_result=True)
+@wrappers.catch(timing=True)
+def compute_partial_results(result: dict, request_id: str, workers: list, from_loc: str, to_loc: str,
+                            start_date: str, nb_passenger: str, fingerprint: str = None) -> list:
+    """Streaming mode: called as soon as a single worker is done"""
+    logger.info("Got partial request {} from {}: from={} to={} start={} nb_passenger={}", request_id,
+                result["worker"], from_loc, to_loc, start_date, nb_passenger)
+
+    partials = [result] if result["status"] in ("success", "partial") else []
+    response = list()
+    try:
+        response = build_journeys(partials, from_loc, to_loc, start_date, nb_passenger)
+    finally:
+        # Stored even if the journeys could not be built, so that the request still completes
+        version = streaming.store_partial_results(
+            app.backend.client, request_id, result["worker"], response, nb_workers=len(workers)
+        )
+        logger.info("Published {} journeys from {} (version {})", len(response), result["worker"], version)
+    if fingerprint is not None:
+        cache_search_results(fingerprint, partials, {result["worker"]: response})
     return response
+
+
+@app.task(name="broker.failed", bind=True, ignore_result=True)
+@wrappers.catch()
+def record_failed_worker(task_id: str, request_id: str, workers: list, worker: str) -> list:
+    """
+    Streaming mode: called instead of broker.partial when a worker task failed
+    without a payload, e.g. killed by its hard time limit. The worker is stored
+    without journeys so that the request can still complete.
+    """
+    logger.warning("Worker {} failed for request {} (task {})", worker, request_id, task_id)
+    version = streaming.store_partial_results(
+        app.backend.client, request_id, worker, list(), nb_workers=len(workers)
+    )
+    logger.info("Published no journeys from {} (version {})", worker, version)
+    return list()
@@ -0,0 +1,121 @@
+"""
+URBAN LEGS
+
+First and last mile legs (departure point to station, station to arrival point)
+are first queried on Navitia, with a fallback on ORS when Navitia has no answer.
+Legs are independent from each other, so they are resolved concurrently.
+Answers are kept in the urban legs cache (see cache.py).
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+from loguru import logger
+
+from . import config
+from . import Navitia
+from . import TMW
+from .cache import urban_cache
+from worker.ors.tasks import ors_query_directions
+
+PROVIDER_NAVITIA = "navitia"
+PROVIDER_ORS = "ors"
+NAVITIA_PROFILE = "public_transport"
+ORS_PROFILE = "driving-car"
+
+# Per provider concurrency limits, shared by all the tasks of the process
+_navitia_slots = BoundedSemaphore(config.NAVITIA_MAX_CONCURRENCY)
+_ors_slots = BoundedSemaphore(config.ORS_MAX_CONCURRENCY)
+
+
+def navitia_directions(urban_query):
+    with _navitia_slots:
+        return Navitia.navitia_query_directions(urban_query)
+
+
+def ors_directions(urban_query, nb_passenger):
+    with _ors_slots:
+        return ors_query_directions(
+            {
+                "start_point": urban_query.start_point,
+                "end_point": urban_query.end_point,
+                "departure_date": int(urban_query.departure_date),
+                "nb_passenger": nb_passenger,
+            },
+            avoid_ferries=False,
+        )
+
+
+def cache_key(provider, profile, urban_query, nb_passenger=None):
+    """nb_passenger is only given for answers depending on it (ORS car emissions are per passenger)"""
+    if nb_passenger is not None:
+        profile = f"{profile}:{int(nb_passenger)}"
+    return urban_cache.make_key(
+        provider,
+        profile,
+        urban_query.start_point,
+        urban_query.end_point,
+        urban_query.departure_date,
+        config.URBAN_CACHE_BUCKET,
+    )
+
+
+def dump_urban_journeys(urban_journeys):
+    return [journey.to_json(all_steps=True) for journey in urban_journeys]
+
+
+def load_urban_journeys(urban_journeys_json):
+    return [TMW.Journey.from_json(journey, journey["id"]) for journey in urban_journeys_json]
+
+
+def resolve_urban_query(urban_query, nb_passenger):
+    """
+    Returns the provider that answered (None if none did) and the list of
+    urban journeys for the query, chaining the ORS fallback after Navitia.
+    Only actual answers are cached, so that failures are retried.
+    """
+    key = cache_key(PROVIDER_NAVITIA, NAVITIA_PROFILE, urban_query)
+    cached = urban_cache.get(key)
+    if cached is not None:
+        return PROVIDER_NAVITIA, load_urban_journeys(cached)
+
+    urban_journey = navitia_directions(urban_query)
+    if urban_journey is not None:
+        urban_cache.set(key, dump_urban_journeys(urban_journey))
+        return PROVIDER_NAVITIA, urban_journey
+
+    if urban_query.start_point != urban_query.end_point:
+        key = cache_key(PROVIDER_ORS, ORS_PROFILE, urban_query, nb_passenger)
+        cached = urban_cache.get(key)
+        if cached is not None:
+            return PROVIDER_ORS, load_urban_journeys(cached)
+
+        ors_journey = ors_directions(urban_query, nb_passenger)
+        if len(ors_journey.steps) > 0:
+            urban_cache.set(key, dump_urban_journeys([ors_journey]))
+        return PROVIDER_ORS, [ors_journey]
+
+    return None, None
+
+
+def resolve_urban_queries(urban_queries, nb_passenger):
+    """
+    Resolves all the urban queries concurrently.
+    Results are returned in the same order as the queries.
+    """
+    if len(urban_queries) == 0:
+        return list()
+
+    nb_threads = min(len(urban_queries), config.URBAN_QUERIES_MAX_WORKERS)
+    logger.info("Resolving {} urban queries with {} threads", len(urban_queries), nb_threads)
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        # Each thread runs in a copy of the current context to keep the log context
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, resolve_urban_query, urban_query, nb_passenger
+            )
+            for urban_query in urban_queries
+        ]
+        urban_journeys = [future.result() for future in futures]
+    logger.info("Urban legs cache stats: {}", urban_cache.stats)
+    return urban_journeys
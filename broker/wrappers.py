@@ -1,7 +1,20 @@
 import functools
+import itertools
+import reprlib
 from loguru import logger
 from time import perf_counter
 
+from . import config
+
+# Bounded representation of payloads: a few items per container, short strings
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxlist = 3
+_payload_repr.maxdict = 16
+_payload_repr.maxstring = 60
+_payload_repr.maxother = 60
+_payloads_count = itertools.count(1)
+
 
 def catch(*, level="DEBUG", timing=False):
     """Loguru wrapper for contextualized tasks"""
@@ -35,3 +48,25 @@ def catch(*, level="DEBUG", timing=False):
         return wrapped
 
     return wrapper
+
+
+def format_payload(payload) -> str:
+    text = _payload_repr.repr(payload)
+    if len(text) > config.PAYLOAD_LOG_MAX_SIZE:
+        text = text[:config.PAYLOAD_LOG_MAX_SIZE] + "..."
+    return text
+
+
+def log_payload(label: str, payload):
+    """
+    Logs a summary of one payload every PAYLOAD_LOG_SAMPLING, at INFO level.
+    Others are logged at TRACE level, only formatted if a handler shows them.
+    """
+    sampled = config.PAYLOAD_LOG_SAMPLING > 0 and next(_payloads_count) % config.PAYLOAD_LOG_SAMPLING == 0
+    logger.opt(lazy=True).log(
+        "INFO" if sampled else "TRACE",
+        "{} ({} items): {}",
+        lambda: label,
+        lambda: len(payload),
+        lambda: format_payload(payload),
+    )
@@ -1,12 +1,50 @@
 """
 INITIATE CLASSES
+
+Shared by the workers and the broker. Classes are slotted as a lot of them are
+built for each request, and their defaults are evaluated per instance.
 """
-from datetime import datetime as dt
+import time
 from . import constants
 
+# Step types giving its category to a journey, in steps order
+MAIN_TYPES = (constants.TYPE_TRAIN, constants.TYPE_PLANE, constants.TYPE_COACH,
+              constants.TYPE_FERRY, constants.TYPE_CARPOOOLING, constants.TYPE_CAR)
+# Types used as category by journeys without any main type
+URBAN_TYPES = (constants.TYPE_BUS, constants.TYPE_BIKE, constants.TYPE_METRO, constants.TYPE_TRAM)
+CATEGORY_MAIN = 0
+CATEGORY_URBAN = 1
+CATEGORY_PRIORITY = dict([(t, CATEGORY_MAIN) for t in MAIN_TYPES] + [(t, CATEGORY_URBAN) for t in URBAN_TYPES])
+
+
+def _now():
+    return int(time.time())
+
+
+def _steps_totals(steps, totals=(0, 0, 0, 0, 0)):
+    """
+    Adds the steps to the running totals (distance, duration, price, gCO2 and
+    number of steps not bike friendly). Step prices are rounded first, so that
+    the total price is the sum of the displayed ones.
+    """
+    distance, duration, price, gCO2, not_bike_friendly = totals
+    for step in steps:
+        step.price_EUR[:] = [round(p, 2) for p in step.price_EUR]
+        distance += step.distance_m or 0
+        duration += step.duration_s or 0
+        price += sum(step.price_EUR) or 0
+        gCO2 += step.gCO2 or 0
+        not_bike_friendly += not step.bike_friendly
+    return distance, duration, price, gCO2, not_bike_friendly
+
 
 class Journey:
-    def __init__(self, _id, departure_date=dt.now(), arrival_date=dt.now(), booking_link='', steps=[]):
+    __slots__ = ('id', 'category', 'label', 'api_list', 'score', 'total_distance', 'total_duration',
+                 'total_price_EUR', 'total_gCO2', 'departure_point', 'arrival_point', 'departure_date',
+                 'arrival_date', 'is_real_journey', 'booking_link', 'bike_friendly', 'emission_factors', '_steps',
+                 '_totals', '_changed')
+
+    def __init__(self, _id, departure_date=None, arrival_date=None, booking_link='', steps=None):
         self.id = _id
         self.category = '' # car/train/plane
         self.label = []
@@ -18,17 +56,36 @@ class Journey:
         self.total_gCO2 = 0
         self.departure_point = [0, 0]
         self.arrival_point = [0, 0]
-        self.departure_date = departure_date
-        self.arrival_date  = arrival_date
+        self.departure_date = departure_date if departure_date is not None else _now()
+        self.arrival_date = arrival_date if arrival_date is not None else _now()
         self.is_real_journey = True
         self.booking_link = booking_link
         self.bike_friendly = False
-        self.steps = steps
+        # Version of the emission factors gCO2 were computed with
+        self.emission_factors = ''
+        self.steps = steps if steps is not None else []
 
-    def add(self, steps=[]):
-        self.steps.append(steps)
+    @property
+    def steps(self):
+        return self._steps
 
-    def to_json(self):
+    @steps.setter
+    def steps(self, steps):
+        # Totals are recomputed from scratch on next update()
+        self._steps = steps
+        self._totals = None
+        self._changed = True
+
+    def _add_to_totals(self, steps):
+        if self._totals is not None:
+            self._totals = _steps_totals(steps, self._totals)
+        self._changed = True
+
+    def add(self, step):
+        self._steps.append(step)
+        self._add_to_totals([step])
+
+    def to_json(self, all_steps=False):
         json = {'id': self.id or 0,
                 'label': self.label or '',
                 'category': self.category or '',
@@ -43,11 +100,28 @@ class Journey:
                 'total_gCO2': self.total_gCO2 or 0,
                 'is_real_journey': self.is_real_journey or False,
                 'booking_link': self.booking_link or '',
-                'journey_steps': self.jsonify_steps()
+                'emission_factors': self.emission_factors or '',
+                'journey_steps': self.jsonify_steps(all_steps)
                 }
         return json
 
-    def jsonify_steps(self):
+    @classmethod
+    def from_json(cls, json, _id):
+        steps = [Journey_step.from_json(step, _id=i) for i, step in enumerate(json['journey_steps'])]
+        journey = cls(_id,
+                      steps=steps,
+                      departure_date=int(json['departure_date']),
+                      arrival_date=int(json['arrival_date']),
+                      booking_link=json['booking_link'],
+                      )
+        journey.category = json['category']
+        journey.is_real_journey = json['is_real_journey']
+        journey.emission_factors = json.get('emission_factors', '')
+        return journey
+
+    def jsonify_steps(self, all_steps=False):
+        if all_steps:
+            return [step.to_json() for step in self.steps]
         # to filter out steps we don't want to display in the front
         tmp = list()
         for step in self.steps:
@@ -63,29 +137,38 @@ class Journey:
         self.total_duration = 0
         self.total_price_EUR = 0
         self.total_gCO2 = 0
+        # Also the way to have totals recomputed after changing steps in place
+        self._totals = None
+        self._changed = True
         return self
 
     def update(self):
+        """
+        Totals are kept up to date by add(), add_steps() and add_journey_as_steps(),
+        so this does nothing if no step was added since the last call.
+        """
+        if not self._changed:
+            return self
+        if self._totals is None:
+            self._totals = _steps_totals(self._steps)
+        distance, duration, price, gCO2, not_bike_friendly = self._totals
         self.score = 0
-        self.total_distance = sum(filter(None,[step.distance_m for step in self.steps]))
-        self.total_duration = sum(filter(None,[step.duration_s for step in self.steps]))
-        self.total_price_EUR = round(sum(filter(None,[sum(step.price_EUR) for step in self.steps])), 2)
-        self.total_gCO2 = sum(filter(None,[step.gCO2 for step in self.steps]))
-        self.bike_friendly = all(step.bike_friendly for step in self.steps)
-        if len(self.steps)>0:
-            self.departure_point = self.steps[0].departure_point
-            self.arrival_point = self.steps[-1].arrival_point
-            self.departure_date = self.steps[0].departure_date
-            self.arrival_date = self.steps[-1].arrival_date
-            self.category = list((filter(lambda x: x in [constants.TYPE_TRAIN, constants.TYPE_PLANE,constants.TYPE_COACH,
-                                                             constants.TYPE_FERRY, constants.TYPE_CARPOOOLING, constants.TYPE_CAR],
-                                             [step.type for step in self.steps])))
+        self.total_distance = distance
+        self.total_duration = duration
+        self.total_price_EUR = round(price, 2)
+        self.total_gCO2 = gCO2
+        self.bike_friendly = not_bike_friendly == 0
+        if len(self._steps) > 0:
+            self.departure_point = self._steps[0].departure_point
+            self.arrival_point = self._steps[-1].arrival_point
+            self.departure_date = self._steps[0].departure_date
+            self.arrival_date = self._steps[-1].arrival_date
+            self.category = [step.type for step in self._steps
+                             if CATEGORY_PRIORITY.get(step.type) == CATEGORY_MAIN]
             if self.category == list():
-                self.category = list(set((filter(lambda x: x in [constants.TYPE_BUS, constants.TYPE_BIKE, constants.TYPE_METRO,
-                                                 constants.TYPE_TRAM], [step.type for step in self.steps]))))
-            for i in range(len(self.steps)):
-                for j in range(len(self.steps[i].price_EUR)):
-                    self.steps[i].price_EUR[j] = round(self.steps[i].price_EUR[j], 2)
+                self.category = list(set(step.type for step in self._steps
+                                         if CATEGORY_PRIORITY.get(step.type) == CATEGORY_URBAN))
+        self._changed = False
         return self
 
     def add_steps(self, steps_to_add, start_end=True):
@@ -99,15 +182,16 @@ class Journey:
             # we update the ids of the steps to preserve the order of the whole journey
             for step_old in self.steps:
                 step_old.id = step_old.id + nb_steps_to_add
-            self.steps = steps_to_add + self.steps
+            self._steps = steps_to_add + self._steps
             self.departure_date = self.departure_date - additionnal_duration
         # if the steps are at the end of the journey
         else :
             nb_existing_steps = len(self.steps)
             for step_new in steps_to_add:
                 step_new.id = step_new.id + nb_existing_steps
-            self.steps = self.steps + steps_to_add
+            self._steps = self._steps + steps_to_add
             self.arrival_date = self.arrival_date + additionnal_duration
+        self._add_to_totals(steps_to_add)
 
     def add_journey_as_steps(self, journey_to_add, start_end=True):
         # This function is meant to be used only for intra_urban journey
@@ -148,29 +232,37 @@ class Journey:
             pseudo_step.departure_stop_name = self.steps[-1].arrival_stop_name
             pseudo_step.label = f'Tranport entre {self.steps[-1].arrival_stop_name} et' \
                                 f' arrivé au {journey_to_add.steps[-1].arrival_stop_name} '
+            pseudo_step.departure_date = self.arrival_date
+            pseudo_step.arrival_date = self.arrival_date + pseudo_step.duration_s
             nb_existing_steps = len(self.steps)
             pseudo_step.id = nb_existing_steps
             self.steps.append(pseudo_step)
             self.arrival_date = self.arrival_date + additionnal_duration
+        self._add_to_totals([pseudo_step])
 
 
 class Journey_step:
-    def __init__(self, _id, _type, label='', distance_m=0, duration_s=0, price_EUR=[0.0], gCO2 = 0, departure_point=[0.0],
-                 arrival_point=[0.0], departure_stop_name='', arrival_stop_name='', departure_date=dt.now()
-                 , arrival_date=dt.now(), bike_friendly=False, transportation_final_destination='', booking_link='', trip_code='', geojson=''):
+    __slots__ = ('id', 'type', 'label', 'distance_m', 'duration_s', 'price_EUR', 'gCO2', 'departure_point',
+                 'arrival_point', 'departure_stop_name', 'arrival_stop_name', 'departure_date', 'arrival_date',
+                 'trip_code', 'bike_friendly', 'transportation_final_destination', 'booking_link', 'geojson')
+
+    def __init__(self, _id, _type, label='', distance_m=0, duration_s=0, price_EUR=None, gCO2=0, departure_point=None,
+                 arrival_point=None, departure_stop_name='', arrival_stop_name='', departure_date=None,
+                 arrival_date=None, bike_friendly=False, transportation_final_destination='', booking_link='',
+                 trip_code='', geojson=''):
         self.id = _id
         self.type = _type
         self.label = label
         self.distance_m = distance_m
         self.duration_s = duration_s
-        self.price_EUR = price_EUR
+        self.price_EUR = price_EUR if price_EUR is not None else [0.0]
         self.gCO2 = gCO2
-        self.departure_point = departure_point
-        self.arrival_point = arrival_point
+        self.departure_point = departure_point if departure_point is not None else [0.0]
+        self.arrival_point = arrival_point if arrival_point is not None else [0.0]
         self.departure_stop_name = departure_stop_name
         self.arrival_stop_name = arrival_stop_name
-        self.departure_date = departure_date
-        self.arrival_date = arrival_date
+        self.departure_date = departure_date if departure_date is not None else _now()
+        self.arrival_date = arrival_date if arrival_date is not None else _now()
         self.trip_code = trip_code #AF350 / TGV8342 / Métro Ligne 2 ect...
         self.bike_friendly = bike_friendly
         # Direction of metro / final stop on train ect..
@@ -198,8 +290,29 @@ class Journey_step:
                 }
         return json
 
+    @classmethod
+    def from_json(cls, json, _id):
+        return cls(_id,
+                   _type=json['type'],
+                   label=json['label'],
+                   distance_m=float(json['distance_m']),
+                   duration_s=float(json['duration_s']),
+                   price_EUR=json['price_EUR'],
+                   departure_point=json['departure_point'],
+                   arrival_point=json['arrival_point'],
+                   departure_stop_name=json['departure_stop_name'],
+                   arrival_stop_name=json['arrival_stop_name'],
+                   departure_date=int(json['departure_date']),
+                   arrival_date=int(json['arrival_date']),
+                   gCO2=float(json['gCO2']),
+                   booking_link=json['booking_link'],
+                   # bike_friendly=json['bike_friendly'],
+                   )
+
 
 class Query:
+    __slots__ = ('id', 'start_point', 'end_point', 'departure_date')
+
     def __init__(self, _id, start_point, end_point, departure_date=None):
         self.id = _id
         self.start_point = start_point
@@ -213,3 +326,9 @@ class Query:
                  'departure_date': str(self.departure_date),
                 }
         return json
+
+    def key(self):
+        # Hashable equivalent of to_json(), used to deduplicate and index queries
+        return (round(self.start_point[0], 4), round(self.start_point[1], 4),
+                round(self.end_point[0], 4), round(self.end_point[1], 4),
+                str(self.departure_date))
@@ -140,6 +140,12 @@ def blablacar_journey(df_response):
     # all itineraries :
     # print(f'nb itinerary : {df_response.id_global.nunique()}')
     _id = 0
+    # Emissions of the steps of all the trips at once
+    df_response = df_response.assign(
+        gCO2=emission.calculate_co2_emissions_many(
+            constants.TYPE_CARPOOOLING, df_response.distance_in_meters
+        )
+    )
     for trip_id in df_response.trip_id.unique():
         itinerary = df_response[df_response.trip_id == trip_id]
         # Get the arrival info on the same line
@@ -189,9 +195,7 @@ def blablacar_journey(df_response):
         # Go through all steps of the journey
         for index, leg in itinerary.iterrows():
             local_distance_m = leg.distance_in_meters
-            local_emissions = emission.calculate_co2_emissions(
-                constants.TYPE_CARPOOOLING, local_distance_m
-            )
+            local_emissions = leg.gCO2
             step = TMW.Journey_step(
                 i,
                 _type=constants.TYPE_CARPOOOLING,
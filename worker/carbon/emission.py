@@ -1,6 +1,38 @@
-import pandas as pd
+"""
+CO2 EMISSIONS
+
+Emission factors (kgCO2e per passenger.km) come from emission.csv. The CSV is
+compiled at load time into an EmissionTable, so that computing the emissions
+of a leg is a dict lookup (plus a bisect on distance bands for planes) instead
+of filtering the whole frame with pandas. calculate_co2_emissions_many does
+the same for arrays of legs, e.g. the columns of a results DataFrame.
+
+The same legs come back in many journeys, so calculate_co2_emissions results
+are also memoized (see EMISSION_CACHE_SIZE and EMISSION_CACHE_RESOLUTION_M).
+
+Factors can be updated without restarting the workers: each process checks
+every EMISSION_RELOAD_INTERVAL seconds whether the factors changed, either in
+Redis (published with `python -m worker.carbon.emission publish <csv>`) or on
+disk, and swaps in a freshly compiled table. Tables are versioned by the hash
+of their CSV. A task uses the table current when it started until it ends (see
+current_table), and its journeys are stamped with the version of that table.
+"""
+import functools
+import hashlib
+import io
+import math
+import sys
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
 from pathlib import Path
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+import redis
 from loguru import logger
+from .. import config
 from .. import constants
 
 # DEFAULT VALUES
@@ -22,60 +54,321 @@ FUEL = "fuel"
 
 # Path relative to current file,update if necessary
 CARBON_DF_PATH = Path(__file__).parent.absolute() / "emission.csv"
+# Published factors: hash with the "version" and "csv" fields
+FACTORS_KEY = "bonvoyage:emission:factors"
 
 # Carbon dataframe,let's singleton it !
 carbon_frame = None
+# Compiled from carbon_frame
+emission_table = None
+
+# Reloading state
+_reload_lock = Lock()
+_next_check = 0.0
+_file_mtime = None
+_redis = None
+
+
+def _mean(values):
+    # As pandas mean: NaN values are skipped, NaN if there are none
+    values = [value for value in values if not math.isnan(value)]
+    return sum(values) / len(values) if len(values) > 0 else math.nan
+
+
+class _Factor:
+    """Factor of a (transport, fuel) pair, for a given type of city if any"""
+
+    __slots__ = ("rows", "value", "edges", "points", "intervals", "_arrays")
+
+    def __init__(self, rows, distance_bands):
+        # rows: (city, city_size_min, city_size_max, distance_min, distance_max, value)
+        self.rows = rows
+        self.value = _mean([row[5] for row in rows])
+        self.edges = self.points = self.intervals = None
+        if distance_bands:
+            # Bands bounds are exclusive and may overlap: the factor is constant
+            # between two consecutive bounds, and on each bound
+            self.edges = sorted({bound for row in rows for bound in row[3:5] if not math.isnan(bound)})
+            samples = [self.edges[0] - 1] if self.edges else [0]
+            for i, edge in enumerate(self.edges):
+                upper = self.edges[i + 1] if i + 1 < len(self.edges) else edge + 2
+                samples += [edge, (edge + upper) / 2]
+            values = [self._filter_distance(distance_km) for distance_km in samples]
+            self.intervals = values[0::2]
+            self.points = values[1::2]
+        self._arrays = None
+
+    def _filter_distance(self, distance_km):
+        return _mean([row[5] for row in self.rows if row[3] < distance_km < row[4]])
+
+    def get(self, distance_km):
+        if self.edges is None:
+            return self.value
+        if math.isnan(distance_km):
+            return math.nan
+        i = bisect_left(self.edges, distance_km)
+        if i < len(self.edges) and self.edges[i] == distance_km:
+            return self.points[i]
+        return self.intervals[i]
+
+    def get_many(self, distance_km: np.ndarray) -> np.ndarray:
+        if self.edges is None:
+            return np.full(distance_km.shape, self.value)
+        if self._arrays is None:
+            self._arrays = (np.array(self.edges), np.array(self.points), np.array(self.intervals))
+        edges, points, intervals = self._arrays
+        i = np.searchsorted(edges, distance_km, side="left")
+        values = intervals[i]
+        if len(edges) > 0:
+            on_edge = np.minimum(i, len(edges) - 1)
+            on_edge = np.flatnonzero((i < len(edges)) & (edges[on_edge] == distance_km))
+            values[on_edge] = points[i[on_edge]]
+        values[np.isnan(distance_km)] = np.nan
+        return values
+
+
+class EmissionTable:
+    """
+    Emission factors by transport type and fuel, as compiled from the carbon
+    frame. Factors only depend on distance for planes (short, medium and long
+    haul bands), and they are NaN when no factor matches, as the mean of an
+    empty frame.
+    """
+
+    def __init__(self, frame: pd.DataFrame, version: str = ""):
+        self.version = version
+        self.factors = dict()
+        # Factors for a given type of city, compiled on first use
+        self.city_factors = dict()
+        columns = [CITY, CITY_SIZE_MIN, CITY_SIZE_MAX, NB_KM_MIN, NB_KM_MAX, "value"]
+        for transport, transport_frame in frame.groupby(TYPE_OF_TRANSPORT):
+            distance_bands = transport == constants.TYPE_PLANE
+            fuels = transport_frame[FUEL]
+            # No fuel given: average value, or rows without fuel
+            default = transport_frame[(fuels == "avg") | pd.isna(fuels)]
+            self.factors[(transport, None)] = _Factor(self._rows(default[columns]), distance_bands)
+            for fuel, fuel_frame in transport_frame.groupby(FUEL):
+                self.factors[(transport, fuel)] = _Factor(self._rows(fuel_frame[columns]), distance_bands)
+
+    @staticmethod
+    def _rows(frame):
+        return [
+            (city if isinstance(city, str) else None, float(size_min), float(size_max),
+             float(distance_min), float(distance_max), float(value))
+            for city, size_min, size_max, distance_min, distance_max, value in frame.itertuples(index=False)
+        ]
+
+    def _factor(self, type_transport, fuel, type_city):
+        factor = self.factors.get((type_transport, fuel))
+        if factor is None or type_city is None:
+            return factor
+
+        key = (type_transport, fuel, tuple(type_city))
+        city_factor = self.city_factors.get(key)
+        if city_factor is None:
+            city, size_min, size_max = type_city[0], float(type_city[1]), float(type_city[2])
+            rows = [
+                row for row in factor.rows
+                if row[0] == city and row[1] >= size_min and row[2] < size_max
+            ]
+            city_factor = self.city_factors.setdefault(key, _Factor(rows, factor.edges is not None))
+        return city_factor
+
+    def factor(self, type_transport, distance_km, fuel=None, type_city=None) -> float:
+        """kgCO2e per passenger.km"""
+        factor = self._factor(type_transport, fuel, type_city)
+        return math.nan if factor is None else factor.get(distance_km)
+
+    def factors_many(self, type_transport, distance_km: np.ndarray, fuel=None, type_city=None) -> np.ndarray:
+        """factor() for an array of distances"""
+        factor = self._factor(type_transport, fuel, type_city)
+        return np.full(distance_km.shape, np.nan) if factor is None else factor.get_many(distance_km)
+
+
+def factors_version(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def compile_factors(data: bytes):
+    """Carbon frame and compiled table of the CSV content"""
+    frame = pd.read_csv(io.BytesIO(data), delimiter=",")
+    return frame, EmissionTable(frame, version=factors_version(data))
+
+
+def _swap(frame, table):
+    global carbon_frame, emission_table
+    # Both are replaced at once, tasks running keep their current_table
+    carbon_frame, emission_table = frame, table
+    # Results of the previous factors
+    _cached_co2_emissions.cache_clear()
+    logger.info("Loaded emission factors version {}", table.version)
+
+
+def _factors_path():
+    return Path(config.EMISSION_FACTORS_PATH) if config.EMISSION_FACTORS_PATH else CARBON_DF_PATH
 
 
 def init_carbon():
-    global carbon_frame
-    carbon_frame = pd.read_csv(CARBON_DF_PATH, delimiter=",")
-    logger.debug("Loaded global carbon frame.")
+    global _file_mtime, _next_check
+    path = _factors_path()
+    _file_mtime = path.stat().st_mtime
+    _swap(*compile_factors(path.read_bytes()))
+    _next_check = time.monotonic() + config.EMISSION_RELOAD_INTERVAL
+
+
+def _redis_client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(config.EMISSION_FACTORS_REDIS_URL, socket_timeout=0.5)
+    return _redis
+
+
+def _reload():
+    """Swaps in the published factors, or the factors file, if they changed"""
+    global _file_mtime
+    if config.EMISSION_FACTORS_REDIS_URL:
+        client = _redis_client()
+        version = client.hget(FACTORS_KEY, "version")
+        if version is not None and version.decode() != emission_table.version:
+            _, data = client.hmget(FACTORS_KEY, "version", "csv")
+            if data is not None:
+                _swap(*compile_factors(data))
+        return
+
+    path = _factors_path()
+    mtime = path.stat().st_mtime
+    if mtime != _file_mtime:
+        _file_mtime = mtime
+        data = path.read_bytes()
+        if factors_version(data) != emission_table.version:
+            _swap(*compile_factors(data))
+
+
+def refresh_emission_table():
+    """Reloads the factors if they changed, at most every EMISSION_RELOAD_INTERVAL seconds"""
+    global _next_check
+    if config.EMISSION_RELOAD_INTERVAL <= 0 or time.monotonic() < _next_check:
+        return
+    # A single thread checks, the others keep the current table
+    if not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        _next_check = time.monotonic() + config.EMISSION_RELOAD_INTERVAL
+        _reload()
+    except Exception as e:  # noqa
+        logger.warning("Could not reload emission factors, keeping version {}: {}", emission_table.version, e)
+    finally:
+        _reload_lock.release()
 
 
-def get_carbon_frame_for_transport(transport_type: str) -> pd.DataFrame:
-    global carbon_frame
-    if carbon_frame is None:
+def publish_emission_factors(client, data: bytes) -> str:
+    """Publishes factors to all the workers, returns their version"""
+    # Fails on invalid factors before any worker gets them
+    _, table = compile_factors(data)
+    client.hset(FACTORS_KEY, mapping={"version": table.version, "csv": data})
+    return table.version
+
+
+def get_emission_table() -> EmissionTable:
+    if emission_table is None:
         logger.debug("First time carbon frame loading")
-        carbon_frame = pd.read_csv(CARBON_DF_PATH, delimiter=",")
+        init_carbon()
+    else:
+        refresh_emission_table()
+    return emission_table
+
+
+# Table pinned for the running task, None outside of tasks
+current_table: ContextVar = ContextVar("current_table", default=None)
+
+
+def get_task_emission_table() -> EmissionTable:
+    """Table of the running task, so that all its journeys use the same factors"""
+    table = current_table.get()
+    return table if table is not None else get_emission_table()
+
 
-    # Return filtered frame
-    # logger.debug("Returning carbon frame for {} type", transport_type)
-    return carbon_frame[carbon_frame[TYPE_OF_TRANSPORT] == transport_type]
+def _co2_emissions(table, type_transport, distance_m, type_city, fuel, nb_passenger):
+    factor = table.factor(type_transport, distance_m / 1000, fuel=fuel, type_city=type_city)
+
+    # The result will be in grams of CO2
+    if type_transport == constants.TYPE_CAR:
+        # For individual car we divide the impact by the number of passengers
+        return factor * distance_m / nb_passenger
+    return factor * distance_m
+
+
+@functools.lru_cache(maxsize=max(config.EMISSION_CACHE_SIZE, 0))
+def _cached_co2_emissions(table, type_transport, distance_m, type_city, fuel, nb_passenger):
+    # Keyed on the table too, so that no result of replaced factors is returned
+    return _co2_emissions(table, type_transport, distance_m, type_city, fuel, nb_passenger)
+
+
+def quantize_distance(distance_m):
+    resolution = config.EMISSION_CACHE_RESOLUTION_M
+    if resolution <= 0:
+        return distance_m
+    return round(distance_m / resolution) * resolution
 
 
 def calculate_co2_emissions(
     type_transport, distance_m, type_city=None, fuel=None, nb_seats=None, nb_passenger=1
 ):
-    # read csv
-    carbon_df = get_carbon_frame_for_transport(transport_type=type_transport)
-
-    if type_city is not None:
-        carbon_df = carbon_df[carbon_df[CITY] == type_city[0]]
-        filter_city_size = (carbon_df.loc[:, CITY_SIZE_MIN] >= float(type_city[1])) & (
-            carbon_df.loc[:, CITY_SIZE_MAX] < float(type_city[2])
-        )
-        carbon_df = carbon_df[filter_city_size]
-
-    # For Planes we differentiate for court, moyen and long courrier
-    if type_transport == constants.TYPE_PLANE:
-        carbon_df = carbon_df[
-            (carbon_df[NB_KM_MIN] < distance_m / 1000)
-            & (carbon_df[NB_KM_MAX] > distance_m / 1000)
-        ]
+    table = get_task_emission_table()
+    distance_m = float(distance_m)
+    if config.EMISSION_CACHE_SIZE <= 0 or math.isnan(distance_m):
+        return _co2_emissions(table, type_transport, distance_m, type_city, fuel, nb_passenger)
+    return _cached_co2_emissions(
+        table,
+        type_transport,
+        quantize_distance(distance_m),
+        tuple(type_city) if type_city is not None else None,
+        fuel,
+        nb_passenger,
+    )
+
+
+def cache_stats() -> dict:
+    """Statistics of the memoized emissions, for monitoring"""
+    info = _cached_co2_emissions.cache_info()
+    calls = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_ratio": round(info.hits / calls, 3) if calls > 0 else None,
+    }
 
-    if fuel is None:
-        # We take the avg value then
-        carbon_df = carbon_df[(carbon_df[FUEL] == "avg") | (pd.isna(carbon_df[FUEL]))]
-    else:
-        carbon_df = carbon_df[carbon_df[FUEL] == fuel]
+
+def calculate_co2_emissions_many(
+    type_transport, distance_m, type_city=None, fuel=None, nb_passenger=1
+) -> np.ndarray:
+    """
+    calculate_co2_emissions for arrays of legs, in one pass per transport type.
+    type_transport, distance_m and nb_passenger are arrays or scalars shared
+    by all the legs; type_city and fuel are shared by all the legs.
+    """
+    type_transport, distance_m, nb_passenger = np.broadcast_arrays(
+        np.asarray(type_transport, dtype=object),
+        np.asarray(distance_m, dtype=np.float64),
+        np.asarray(nb_passenger, dtype=np.float64),
+    )
+    table = get_task_emission_table()
+    factors = np.empty(distance_m.shape)
+    for transport in set(type_transport.ravel().tolist()):
+        legs = type_transport == transport
+        factors[legs] = table.factors_many(transport, distance_m[legs] / 1000, fuel=fuel, type_city=type_city)
 
     # The result will be in grams of CO2
-    if type_transport == constants.TYPE_CAR:
-        # For individual car we divide the impact by the number of passengers
-        logger.info(f'wesh wesh represent le port du havre ma gueuele {nb_passenger}')
-        carbon_result = carbon_df["value"].mean() * distance_m / nb_passenger
-    else :
-        carbon_result = carbon_df["value"].mean() * distance_m
+    emissions = factors * distance_m
+    # For individual car we divide the impact by the number of passengers
+    return np.where(type_transport == constants.TYPE_CAR, emissions / nb_passenger, emissions)
+
 
-    return carbon_result
+if __name__ == "__main__":
+    # python -m worker.carbon.emission publish <csv>
+    if len(sys.argv) != 3 or sys.argv[1] != "publish" or not config.EMISSION_FACTORS_REDIS_URL:
+        sys.exit("Usage: EMISSION_FACTORS_REDIS_URL=... python -m worker.carbon.emission publish <csv>")
+    published = publish_emission_factors(_redis_client(), Path(sys.argv[2]).read_bytes())
+    print(f"Published emission factors version {published}")
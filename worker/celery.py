@@ -1,6 +1,7 @@
 from celery import Celery
 from loguru import logger
 from worker.exception import WorkerException
+from worker import wire
 import os
 import importlib
 
@@ -20,6 +21,17 @@ def make_app(name, routing_key=None, init_fn=None, task_cls=None):
     clry.conf.task_default_queue = r_key
     clry.conf.task_default_routing_key = f"journey.{r_key}"
 
+    # Encoding of the messages sent to the broker: chord body or streaming callbacks
+    wire_format = os.getenv("WIRE_FORMAT", default="json")
+    if wire_format == wire.ORJSON and not wire.register_orjson():
+        wire_format = "json"
+    clry.conf.task_serializer = wire_format
+    # Results stay JSON whatever the wire format: the last worker of a chord
+    # decodes the results of all the others with its own result serializer
+    clry.conf.result_serializer = wire.ORJSON if wire_format == wire.ORJSON else "json"
+    clry.conf.accept_content = ["json", "msgpack", wire.SERIALIZER]
+    clry.conf.result_accept_content = ["json", "msgpack", wire.SERIALIZER]
+
     clry.autodiscover_tasks(packages=[f"worker.{name}"])
     if init_fn is not None:
         logger.info("Worker init using {}()", init_fn)
@@ -13,3 +13,17 @@ SKYSCANNER_API_KEY = os.getenv("SKYSCANNER_API_KEY")
 SKYSCANNER_RAPIDAPI_KEY = os.getenv("SKYSCANNER_RAPIDAPI_KEY")
 KOMBO_API_KEY = os.getenv("KOMBO_API_KEY")
 BLABLACAR_API_KEY = os.getenv("BLABLACAR_API_KEY")
+
+# Memoized CO2 emissions: number of results kept per process (0 disables it), and resolution
+# the distances are rounded to, in meters (0 keeps exact distances)
+EMISSION_CACHE_SIZE = int(os.getenv("EMISSION_CACHE_SIZE", 4096))
+EMISSION_CACHE_RESOLUTION_M = float(os.getenv("EMISSION_CACHE_RESOLUTION_M", 0))
+
+# Emission factors: CSV file (defaults to the one shipped), Redis the updated factors are published
+# on (defaults to none, only the file is watched), and delay between two checks for updates in seconds
+EMISSION_FACTORS_PATH = os.getenv("EMISSION_FACTORS_PATH")
+EMISSION_FACTORS_REDIS_URL = os.getenv("EMISSION_FACTORS_REDIS_URL")
+EMISSION_RELOAD_INTERVAL = float(os.getenv("EMISSION_RELOAD_INTERVAL", 60))
+
+# Airports considered around the departure and arrival points, great circle distance in km
+PLANES_AIRPORT_RADIUS_KM = float(os.getenv("PLANES_AIRPORT_RADIUS_KM", 75))
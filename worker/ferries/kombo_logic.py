@@ -5,6 +5,7 @@ import copy
 import time
 from loguru import logger
 from geopy.distance import distance
+from worker import utils
 from worker.carbon import emission
 
 from .. import config as tmw_api_keys, constants
@@ -241,6 +242,9 @@ def search_kombo(id_dep, id_arr, date, nb_passengers=1, fast_response=False):
         keep_looking = False
 
     while keep_looking:
+        if utils.get_budget().is_exhausted():
+            logger.warning("Time budget exhausted, stop polling kombo")
+            break
         time.sleep(0.5)
         response = requests.get(
             f"https://turing.kombo.co/pollSearch/{pollkey}", headers=headers
@@ -452,8 +456,11 @@ def compute_kombo_journey(all_cities, start, fast_response=False):
 
     start = dt.fromtimestamp(start)
     found_low_carbon = False
+    budget = utils.get_budget()
     for origin_city in all_cities["origin"]:
         for arrival_city in all_cities["arrival"]:
+            if budget.is_exhausted():
+                break
             all_trips = all_trips.append(
                 search_kombo(
                     origin_city,
@@ -469,7 +476,7 @@ def compute_kombo_journey(all_cities, start, fast_response=False):
                     found_low_carbon = True
                     break
             time.sleep(0.1)
-        if found_low_carbon:
+        if found_low_carbon or budget.is_exhausted():
             break
 
     if len(all_trips) == 0:
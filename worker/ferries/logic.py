@@ -80,7 +80,11 @@ def get_ferries(date_departure, departure_point, arrival_point, ferry_db, routes
 
     relevant_routes = pd.DataFrame()
 
+    budget = utils.get_budget()
     for index, route in routes.iterrows():
+        if budget.is_exhausted():
+            logger.warning("Time budget exhausted, stop checking ferry routes")
+            break
         car_journey_dep = ors_query_directions(
             {
                 "start_point": departure_point,
@@ -141,12 +145,14 @@ def get_ferries(date_departure, departure_point, arrival_point, ferry_db, routes
 def ferry_journey(journeys):
 
     journey_list = list()
+    # Emissions of all the journeys at once
+    journeys = journeys.assign(
+        gCO2=emission.calculate_co2_emissions_many(constants.TYPE_FERRY, journeys.distance_m)
+    )
 
     for index, row in journeys.iterrows():
         distance_m = row.distance_m
-        local_emissions = emission.calculate_co2_emissions(
-            constants.TYPE_FERRY, distance_m
-        )
+        local_emissions = row.gCO2
         journey_steps = list()
         journey_step = TMW.Journey_step(
             0,
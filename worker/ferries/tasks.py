@@ -29,6 +29,8 @@ def execute(self, from_loc, to_loc, start_date, nb_passenger):
         ferry_journeys = list()
     else:
         ferry_journeys = logic.ferry_journey(ferry_trips)
+        # Ferry crossings only, returned if we run out of time calling kombo
+        utils.get_budget().save(ferry_journeys)
         # pimp ferry journey with kombo calls
 
         geoloc_port_dep = [
@@ -0,0 +1,77 @@
+"""
+GEO INDEX
+
+Grid index of points (airports, stations...) built once, answering "the k
+nearest points within r km" with true great circle distances. Points are
+bucketed in cells of a few degrees: a query only computes the haversine
+distance of the points in the cells its radius can reach, the longitude span
+of these cells growing with latitude (all of them near the poles).
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great circle distances, coordinates in radians"""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    def __init__(self, latitudes, longitudes, cell_deg: float = 1.0):
+        self.latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+        self.longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+        self.cell_deg = cell_deg
+        self.nb_lon_cells = int(math.ceil(360 / cell_deg))
+
+        cells = dict()
+        lat_cells = np.floor(np.degrees(self.latitudes) / cell_deg).astype(np.int64)
+        lon_cells = np.floor((np.degrees(self.longitudes) + 180) / cell_deg).astype(np.int64) % self.nb_lon_cells
+        for i, cell in enumerate(zip(lat_cells.tolist(), lon_cells.tolist())):
+            cells.setdefault(cell, list()).append(i)
+        self.cells = {cell: np.array(indices) for cell, indices in cells.items()}
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _candidates(self, latitude, longitude, radius_km):
+        radius_deg = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lat_first = math.floor((latitude - radius_deg) / self.cell_deg)
+        lat_last = math.floor((latitude + radius_deg) / self.cell_deg)
+
+        if abs(latitude) + radius_deg >= 90 or radius_deg >= 90:
+            lon_cells = range(self.nb_lon_cells)
+        else:
+            # Widest longitude difference of a circle of the radius
+            ratio = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude))
+            lon_deg = math.degrees(math.asin(min(ratio, 1.0)))
+            lon_first = math.floor((longitude + 180 - lon_deg) / self.cell_deg)
+            lon_last = math.floor((longitude + 180 + lon_deg) / self.cell_deg)
+            if lon_last - lon_first + 1 >= self.nb_lon_cells:
+                lon_cells = range(self.nb_lon_cells)
+            else:
+                lon_cells = {cell % self.nb_lon_cells for cell in range(lon_first, lon_last + 1)}
+
+        indices = [
+            self.cells[(lat_cell, lon_cell)]
+            for lat_cell in range(lat_first, lat_last + 1)
+            for lon_cell in lon_cells
+            if (lat_cell, lon_cell) in self.cells
+        ]
+        return np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+
+    def nearest(self, point, k: int, radius_km: float):
+        """Indices and distances (km) of the k nearest points within radius_km of point (lat, lon), nearest first"""
+        latitude, longitude = float(point[0]), float(point[1])
+        candidates = self._candidates(latitude, longitude, radius_km)
+        distances = haversine_km(
+            math.radians(latitude), math.radians(longitude),
+            self.latitudes[candidates], self.longitudes[candidates],
+        )
+        within = distances <= radius_km
+        candidates, distances = candidates[within], distances[within]
+        order = np.argsort(distances, kind="stable")[:k]
+        return candidates[order], distances[order]
@@ -5,6 +5,7 @@ import copy
 import time
 from loguru import logger
 from geopy.distance import distance
+from worker import utils
 from worker.carbon import emission
 
 from .. import config as tmw_api_keys, constants
@@ -242,6 +243,9 @@ def search_kombo(id_dep, id_arr, date, nb_passengers=1, fast_response=False):
         keep_looking = False
 
     while keep_looking:
+        if utils.get_budget().is_exhausted():
+            logger.warning("Time budget exhausted, stop polling kombo")
+            break
         time.sleep(0.5)
         response = requests.get(
             f"https://turing.kombo.co/pollSearch/{pollkey}", headers=headers
@@ -464,24 +468,29 @@ def compute_kombo_journey(all_cities, start, fast_response=False):
 
     start = dt.fromtimestamp(start)
     found_low_carbon = False
+    budget = utils.get_budget()
     for origin_city in all_cities["origin"]:
         for arrival_city in all_cities["arrival"]:
-            all_trips = all_trips.append(
-                search_kombo(
-                    origin_city,
-                    arrival_city,
-                    start.strftime("%Y-%m-%d"),
-                    nb_passengers=1,
-                    fast_response=fast_response,
-                )
+            if budget.is_exhausted():
+                break
+            trips = search_kombo(
+                origin_city,
+                arrival_city,
+                start.strftime("%Y-%m-%d"),
+                nb_passengers=1,
+                fast_response=fast_response,
             )
+            all_trips = all_trips.append(trips)
+            if len(trips) > 0:
+                # Returned as is if we run out of time before the next searches
+                budget.save(kombo_journey(all_trips.drop_duplicates()))
             # Stop looking when we found train journeys
             if len(all_trips) > 0:
                 if len(all_trips[all_trips["transportType"].isin(["train", "bus"])]) > 0:
                     found_low_carbon = True
                     break
             time.sleep(0.1)
-        if found_low_carbon:
+        if found_low_carbon or budget.is_exhausted():
             break
 
     if len(all_trips) == 0:
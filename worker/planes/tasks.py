@@ -2,7 +2,7 @@ import pandas as pd
 from datetime import datetime as dt
 from geopy.distance import distance
 from . import app
-from worker import wrappers, utils
+from worker import config, geo, wrappers, utils
 from loguru import logger
 from pathlib import Path
 
@@ -34,51 +34,18 @@ def load_airport_db():
 
 # Find the stops close to a geo point
 def get_cities_from_geo_locs(
-    geoloc_dep, geoloc_arrival, airport_db, nb_different_city=2
+    geoloc_dep, geoloc_arrival, airport_db, airport_index, nb_different_city=2
 ):
     """
     This function takes in the departure and arrival points of the TMW journey and returns
-        the 3 closest stations within 50 km
+        the closest airports within PLANES_AIRPORT_RADIUS_KM
     """
-    # We filter only on the closest stops to have a smaller df (thus better perfs)
-    stops_tmp = airport_db[
-        (
-            ((airport_db.latitude - geoloc_dep[0]) ** 2 < 0.6)
-            & ((airport_db.longitude - geoloc_dep[1]) ** 2 < 0.6)
-        )
-        | (
-            ((airport_db.latitude - geoloc_arrival[0]) ** 2 < 0.6)
-            & ((airport_db.longitude - geoloc_arrival[1]) ** 2 < 0.6)
-        )
-    ].copy()
-
-    stops_tmp["distance_dep"] = stops_tmp.apply(
-        lambda x: (geoloc_dep[0] - x.latitude) ** 2
-        + (geoloc_dep[1] - x.longitude) ** 2,
-        axis=1,
-    )
-    stops_tmp["distance_arrival"] = stops_tmp.apply(
-        lambda x: (geoloc_arrival[0] - x.latitude) ** 2
-        + (geoloc_arrival[1] - x.longitude) ** 2,
-        axis=1,
-    )
-
-    # We get all station within approx 55 km (<=> 0.5 of distance proxi)
     parent_station_id_list = dict()
 
     # We keep only the 2 closest cities from dep and arrival
-    parent_station_id_list["origin"] = (
-        stops_tmp[stops_tmp.distance_dep < 0.5]
-        .sort_values(by="distance_dep")
-        .head(nb_different_city)
-        .Code
-    )
-    parent_station_id_list["arrival"] = (
-        stops_tmp[stops_tmp.distance_arrival < 0.5]
-        .sort_values(by="distance_arrival")
-        .head(nb_different_city)
-        .Code
-    )
+    for key, geoloc in (("origin", geoloc_dep), ("arrival", geoloc_arrival)):
+        indices, _ = airport_index.nearest(geoloc, nb_different_city, config.PLANES_AIRPORT_RADIUS_KM)
+        parent_station_id_list[key] = airport_db.Code.iloc[indices]
     return parent_station_id_list
 
 
@@ -305,7 +272,7 @@ def worker(self, from_loc, to_loc, start_date, nb_passenger):
     # departure_date = dt.strptime(start_date, "%Y-%m-%d")
 
     airports = get_cities_from_geo_locs(
-        geoloc_dep, geoloc_arr, airport_database, nb_different_city=2
+        geoloc_dep, geoloc_arr, airport_database, airport_index, nb_different_city=2
     )
 
     plane_trips = compute_plane_journey(airports, plane_database)
@@ -325,4 +292,6 @@ def worker(self, from_loc, to_loc, start_date, nb_passenger):
 
 # Global values
 airport_database = load_airport_db()
+# Built once, lookups only compute distances to the airports around the points
+airport_index = geo.GeoIndex(airport_database.latitude, airport_database.longitude)
 plane_database = load_plane_db()
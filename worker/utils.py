@@ -1,4 +1,6 @@
-from typing import Tuple
+import time
+from contextvars import ContextVar
+from typing import Optional, Tuple
 from pathlib import Path
 
 
@@ -18,3 +20,37 @@ def get_points(from_loc: str, to_loc: str) -> Tuple[list, list]:
 def get_relative_file_path(base_path: str, filename: str) -> Path:
     """Returns a filepath relative to this one"""
     return Path(base_path).parent.absolute() / filename
+
+
+class Budget:
+    """Time budget of a task, long loops stop when it is exhausted"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        # Timestamp given by the API, None for no limit
+        self.deadline = deadline
+        # Whether some work was skipped because of the budget
+        self.exhausted = False
+        # Journeys (as JSON) already built, returned if the task runs out of time
+        self.saved = list()
+
+    def time_left(self) -> float:
+        if self.deadline is None:
+            return float("inf")
+        return self.deadline - time.time()
+
+    def is_exhausted(self) -> bool:
+        """To call before each new piece of work, which is then considered as skipped"""
+        if self.time_left() <= 0:
+            self.exhausted = True
+        return self.exhausted
+
+    def save(self, journeys: list):
+        """Journeys to return if the task is interrupted, replacing the ones saved before"""
+        self.saved = [journey.to_json() for journey in journeys]
+
+
+current_budget: ContextVar = ContextVar("current_budget", default=Budget())
+
+
+def get_budget() -> Budget:
+    return current_budget.get()
@@ -0,0 +1,231 @@
+"""
+WIRE FORMAT
+
+Compact encoding of the messages between workers and broker, registered as the
+"columnar" celery serializer. It is msgpack, except for lists of journeys which
+are sent as columns (one array per field, struct of arrays) with an explicit
+schema version, so field names are not repeated for every journey and step.
+
+Decoded journeys are kept as columns (JourneyColumns) until the broker builds
+its journey objects straight from them. With the Redis backend, the last worker
+of a chord decodes all the results and sends them again to the broker in its
+own format, so columns can also be encoded as JSON, orjson or msgpack.
+"""
+import json
+from decimal import Decimal
+
+import msgpack
+from kombu.serialization import register
+from loguru import logger
+
+from . import TMW
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+SERIALIZER = "columnar"
+CONTENT_TYPE = "application/x-bonvoyage-columnar"
+SCHEMA_VERSION = 2
+# msgpack extension type of a list of journeys
+EXT_JOURNEYS = 1
+
+JOURNEY_FIELDS = (
+    "id", "label", "category", "score", "total_distance", "total_duration", "total_price_EUR",
+    "departure_point", "arrival_point", "departure_date", "arrival_date", "total_gCO2",
+    "is_real_journey", "booking_link", "emission_factors",
+)
+STEP_FIELDS = (
+    "id", "type", "label", "distance_m", "duration_s", "price_EUR", "departure_point", "arrival_point",
+    "departure_stop_name", "arrival_stop_name", "departure_date", "arrival_date", "trip_code", "gCO2",
+    "booking_link",
+)
+_JOURNEY_KEYS = frozenset(JOURNEY_FIELDS + ("journey_steps",))
+_STEP_KEYS = frozenset(STEP_FIELDS)
+
+
+class JourneyColumns:
+    """List of journeys as decoded from the wire, still as columns"""
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns):
+        if columns.get("v") == 1:
+            # Before emission factors versions
+            columns["journeys"]["emission_factors"] = [""] * len(columns["nb_steps"])
+            columns["v"] = SCHEMA_VERSION
+        if columns.get("v") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported journeys schema version: {columns.get('v')}")
+        self.columns = columns
+
+    @classmethod
+    def from_json(cls, journeys):
+        """Columns of a list of Journey.to_json() dicts"""
+        steps = [step for journey in journeys for step in journey["journey_steps"]]
+        return cls({
+            "v": SCHEMA_VERSION,
+            "nb_steps": [len(journey["journey_steps"]) for journey in journeys],
+            "journeys": {field: [journey[field] for journey in journeys] for field in JOURNEY_FIELDS},
+            "steps": {field: [step[field] for step in steps] for field in STEP_FIELDS},
+        })
+
+    def __len__(self):
+        return len(self.columns["nb_steps"])
+
+    def __iter__(self):
+        return iter(self.to_json())
+
+    def _rows(self, columns, fields):
+        return zip(*(columns[field] for field in fields))
+
+    def to_json(self):
+        """Back to a list of Journey.to_json() dicts"""
+        steps = [dict(zip(STEP_FIELDS, row)) for row in self._rows(self.columns["steps"], STEP_FIELDS)]
+        journeys = list()
+        offset = 0
+        for nb_steps, row in zip(self.columns["nb_steps"], self._rows(self.columns["journeys"], JOURNEY_FIELDS)):
+            journey = dict(zip(JOURNEY_FIELDS, row))
+            journey["journey_steps"] = steps[offset:offset + nb_steps]
+            offset += nb_steps
+            journeys.append(journey)
+        return journeys
+
+    def __json__(self):
+        # Re-encoded as JSON by kombu, e.g. when a worker using another format
+        # forwards the chord results to the broker
+        return self.to_json()
+
+    def to_journeys(self, id_journey=0):
+        """Journey objects, as TMW.Journey.from_json() builds them, ids starting at id_journey"""
+        s = self.columns["steps"]
+        j = self.columns["journeys"]
+        journeys = list()
+        offset = 0
+        for i, nb_steps in enumerate(self.columns["nb_steps"]):
+            steps = [
+                TMW.Journey_step(
+                    k - offset,
+                    _type=s["type"][k],
+                    label=s["label"][k],
+                    distance_m=float(s["distance_m"][k]),
+                    duration_s=float(s["duration_s"][k]),
+                    price_EUR=s["price_EUR"][k],
+                    departure_point=s["departure_point"][k],
+                    arrival_point=s["arrival_point"][k],
+                    departure_stop_name=s["departure_stop_name"][k],
+                    arrival_stop_name=s["arrival_stop_name"][k],
+                    departure_date=int(s["departure_date"][k]),
+                    arrival_date=int(s["arrival_date"][k]),
+                    gCO2=float(s["gCO2"][k]),
+                    booking_link=s["booking_link"][k],
+                )
+                for k in range(offset, offset + nb_steps)
+            ]
+            offset += nb_steps
+            journey = TMW.Journey(
+                id_journey + i,
+                steps=steps,
+                departure_date=int(j["departure_date"][i]),
+                arrival_date=int(j["arrival_date"][i]),
+                booking_link=j["booking_link"][i],
+            )
+            journey.category = j["category"][i]
+            journey.is_real_journey = j["is_real_journey"][i]
+            journey.emission_factors = j["emission_factors"][i]
+            journeys.append(journey)
+        return journeys
+
+
+def is_journey_list(obj):
+    return len(obj) > 0 and all(
+        isinstance(journey, dict)
+        and journey.keys() == _JOURNEY_KEYS
+        and all(isinstance(step, dict) and step.keys() == _STEP_KEYS for step in journey["journey_steps"])
+        for journey in obj
+    )
+
+
+def _pack_journeys(journeys):
+    return msgpack.ExtType(EXT_JOURNEYS, msgpack.packb(journeys.columns, use_bin_type=True))
+
+
+def _prepare(obj):
+    """Replaces the lists of journeys found in obj by their columns"""
+    if isinstance(obj, dict):
+        return {key: _prepare(value) for key, value in obj.items()}
+    if isinstance(obj, JourneyColumns):
+        return _pack_journeys(obj)
+    if isinstance(obj, (list, tuple)):
+        if is_journey_list(obj):
+            return _pack_journeys(JourneyColumns.from_json(obj))
+        return [_prepare(value) for value in obj]
+    return obj
+
+
+def _ext_hook(code, data):
+    if code == EXT_JOURNEYS:
+        return JourneyColumns(msgpack.unpackb(data, raw=False))
+    return msgpack.ExtType(code, data)
+
+
+def dumps(obj):
+    return msgpack.packb(_prepare(obj), use_bin_type=True)
+
+
+def loads(data):
+    return msgpack.unpackb(data, raw=False, ext_hook=_ext_hook)
+
+
+register(SERIALIZER, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, JourneyColumns):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+
+def msgpack_dumps(obj):
+    return msgpack.packb(obj, use_bin_type=True, default=_msgpack_default)
+
+
+def msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+# kombu "msgpack" serializer, also encoding decoded columns
+register("msgpack", msgpack_dumps, msgpack_loads, content_type="application/x-msgpack", content_encoding="binary")
+
+
+# "orjson" serializer: mirrors api/bv/encoding.py, which is not deployed with
+# the workers, and also encodes decoded columns
+ORJSON = "orjson"
+
+
+def _orjson_default(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, JourneyColumns):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def orjson_dumps(obj):
+    return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
+
+def register_orjson():
+    """Registers the "orjson" serializer, returns whether orjson is available"""
+    if orjson is None:
+        logger.warning("orjson is not installed, falling back on json")
+        return False
+    register(ORJSON, orjson_dumps, orjson_loads, content_type="application/json", content_encoding="utf-8")
+    return True
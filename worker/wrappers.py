@@ -1,6 +1,16 @@
 import functools
+from celery.exceptions import SoftTimeLimitExceeded
 from loguru import logger
 from time import perf_counter
+from worker import utils
+from worker.carbon import emission
+
+
+def stamp_emission_factors(journeys, version):
+    """Sets the version of the emission factors on the journeys which do not have one"""
+    for journey in journeys or []:
+        if isinstance(journey, dict) and not journey.get("emission_factors"):
+            journey["emission_factors"] = version
 
 
 def catch(*, level="DEBUG", timing=False):
@@ -21,16 +31,37 @@ def catch(*, level="DEBUG", timing=False):
                 "journey.", ""
             )
 
+            # Time budget given by the API, if any
+            budget = utils.Budget(kwargs.pop("deadline", None))
+            token = utils.current_budget.set(budget)
+            table_token = None
+
             with logger.contextualize(corrid=corr_id, task_id=task.request.id):
                 try:
                     if timing:
                         start = perf_counter()
+                    # Emission factors used by the whole task, even if they are reloaded meanwhile
+                    table = emission.get_emission_table()
+                    table_token = emission.current_table.set(table)
                     result = func(self=task, *args, **kwargs)
+                    stamp_emission_factors(result, table.version)
+                    if budget.exhausted:
+                        logger.warning("Time budget exhausted, returning partial results")
                     payload = {
-                        "status": "success",
+                        "status": "partial" if budget.exhausted else "success",
                         "worker": worker_name,
                         "result": result,
                     }
+                except SoftTimeLimitExceeded:
+                    # Journeys saved so far, if any, the broker must not wait for us anyway
+                    logger.warning("Soft time limit exceeded, returning {} saved journeys", len(budget.saved))
+                    if table_token is not None:
+                        stamp_emission_factors(budget.saved, table.version)
+                    payload = {
+                        "status": "partial",
+                        "worker": worker_name,
+                        "result": budget.saved,
+                    }
                 except Exception as e:  # noqa
                     logger.error("Exception in task: {}", e)
                     payload = {
@@ -42,6 +73,10 @@ def catch(*, level="DEBUG", timing=False):
                     if timing:
                         end = perf_counter() - start
                         logger.info("Task took {}s to execute", end)
+                        logger.debug("Emissions cache stats: {}", emission.cache_stats())
+                    utils.current_budget.reset(token)
+                    if table_token is not None:
+                        emission.current_table.reset(table_token)
             return payload
 
         return wrapped